@@ -12,84 +12,75 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import argparse
+import itertools
 import os
-from base64 import b64decode, decode
+import sys
+import threading
 
-from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
+from config import DEVICE_HOSTNAME, DEVICE_PID, DEVICE_SERIAL, LICENSE_TAGS
+from flows import runJobs
+from inventory import Device, batched, loadInventory
+from metrics import metrics
+from output import console
+from outputstore import OutputStore
+from smartaccount import SmartAccount, decodeSmartLicense, setQuiet
+from tenants import loadTenants, printSummary, runTenants
 
-from smartaccount import SmartAccount
 
-# Load environment variables
-load_dotenv()
-DEVICE_SERIAL = os.getenv("DEVICE_SERIAL")
-DEVICE_PID = os.getenv("DEVICE_PID")
-DEVICE_HOSTNAME = os.getenv("DEVICE_HOSTNAME")
-
-console = Console()
-
-
-def run():
+def run(store):
     """
     Process for performing an offline reservation for a Smart License
 
-    This will print out & save a file locally with the device license data
+    This will print out & save the device license data to the output store
     """
     sa = SmartAccount()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Authenticate to Cisco SSO",
-            title="Step 1",
-        )
-    )
+    console.step("Authenticate to Cisco SSO", "Step 1")
     sa.getAuthToken()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Locate Smart Account & Virtual Account IDs",
-            title="Step 2",
-        )
-    )
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 2")
     sa.getAccountIDs()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Request License Authorization Code",
-            title="Step 3",
+    console.step("Request License Authorization Code", "Step 3")
+    # If an earlier run was interrupted, pick up its request rather than
+    # submitting another one
+    outstanding = sa.outstandingJobs("reserve", (DEVICE_PID, DEVICE_SERIAL))
+    if outstanding:
+        job = outstanding[-1]
+        console.print(f"Resuming earlier request. Poll ID: {job.poll_id}")
+    else:
+        device = Device(
+            DEVICE_PID, DEVICE_SERIAL, DEVICE_HOSTNAME, sa.tenant.license_tags
         )
-    )
-    poll_id = sa.requestAuthCode(DEVICE_PID, DEVICE_SERIAL, DEVICE_HOSTNAME)
+        job = sa.requestAuthCodes([device])
+    poll_id = job.poll_id
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Check Request Status",
-            title="Step 4",
-        )
-    )
-    poll_data = sa.getPollRequest(poll_id, "authorizations")
+    console.step("Check Request Status", "Step 4")
+    poll_data = sa.getPollRequest(poll_id, "authorizations", job.headers)
+    if not poll_data:
+        # Failed or timed out, the error was printed while polling
+        sys.exit(1)
 
     # Parse license response
     if poll_data["data"]["authorizations"][0]["status"] == "FAILED":
         console.print("\n[red]Request failed. Error:")
         console.print(poll_data["data"]["authorizations"][0]["status_message"])
     else:
-        license_key = b64decode(
-            poll_data["data"]["authorizations"][0]["smart_license"]
-        ).decode("utf-8")
-        console.print("\nLicense Data:")
-        console.print(f"{license_key}", markup=False, soft_wrap=True)
+        try:
+            license_key = decodeSmartLicense(
+                poll_data["data"]["authorizations"][0]["smart_license"]
+            )
+        except ValueError as e:
+            console.print(f"\n[red]{e}")
+            sys.exit(1)
         # Save to local file & print next steps
-        with open("lic.txt", "w") as a:
-            a.write(license_key)
-            console.print("\nLicense saved to: [bold]lic.txt")
+        filename = store.save(
+            "lic", DEVICE_PID, DEVICE_SERIAL, poll_id, license_key, LICENSE_TAGS
+        )
+        console.print(f"\nLicense saved to: [bold]{filename}")
         console.print(
-            "\nPlease copy file to device & import with command: license smart import <bootflash|tftp>:lic.txt"
+            f"\nPlease copy file to device & import with command: license smart import <bootflash|tftp>:{os.path.basename(filename)}"
         )
         console.print(
             "Then run: license smart save usage all file <bootflash|tftp>:<filename>"
@@ -97,5 +88,181 @@ def run():
         console.print("And run script #02 to upload usage report.")
 
 
+def runBatch(inventory_file, batch_size, store, tenant=None):
+    """
+    Process for performing offline reservations for many devices at once
+
+    Devices are read from an inventory file & packed into batched requests.
+    Each returned license is saved to the output store. Uses the tenant's
+    credentials & accounts if given, otherwise those in .env.
+    Returns dict of device counts
+    """
+    sa = SmartAccount(tenant)
+    devices = loadInventory(inventory_file, default_entitlements=sa.tenant.license_tags)
+    # Requests left outstanding by an interrupted run are polled again rather
+    # than submitted twice, so skip the devices they cover
+    resumed = sa.outstandingJobs("reserve")
+    pending = {device.udi for job in resumed for device in job.context}
+    batches = list(
+        batched([device for device in devices if device.udi not in pending], batch_size)
+    )
+    console.print(
+        f"Loaded {len(devices)} devices from {inventory_file} ({len(batches)} batches)"
+    )
+    if pending:
+        console.print(f"{len(pending)} device(s) already have requests in progress")
+
+    console.step("Authenticate to Cisco SSO", "Step 1")
+    sa.getAuthToken()
+
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 2")
+    sa.getAccountIDs()
+
+    console.step("Request & Save Licenses", "Step 3")
+    if resumed:
+        console.print(f"Resuming {len(resumed)} outstanding request(s)")
+    totals = {"devices": len(devices), "saved": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def count(key, value=1):
+        with lock:
+            totals[key] += value
+
+    def decode(result):
+        # Fan results back out to the devices in this batch
+        job, poll_data = result
+        batch = job.context
+        if not poll_data:
+            console.print(f"[red]No result for Poll ID {job.poll_id}: {job.error}")
+            count("failed", len(batch))
+            return []
+        console.print(
+            f"[green]Poll ID {job.poll_id} completed after {job.attempts} attempt(s)"
+        )
+        licenses = []
+        for device in batch:
+            device_auth = findAuthorization(poll_data, device)
+            if not device_auth or device_auth["status"] == "FAILED":
+                message = device_auth["status_message"] if device_auth else "Missing"
+                console.print(f"[red]{device.pid} - SN: {device.serial}: {message}")
+                count("failed")
+                continue
+            try:
+                license_key = decodeSmartLicense(device_auth["smart_license"])
+            except ValueError as e:
+                console.print(f"[red]{device.pid} - SN: {device.serial}: {e}")
+                count("failed")
+                continue
+            licenses.append((job, device, license_key))
+        return licenses
+
+    def write(item):
+        job, device, license_key = item
+        store.save(
+            "lic",
+            device.pid,
+            device.serial,
+            job.poll_id,
+            license_key,
+            device.entitlements,
+        )
+        count("saved")
+
+    # Licenses are written out as soon as each batch completes while other
+    # batches are still being polled
+    console.print(f"Processing {len(resumed) + len(batches)} request(s)...")
+    runJobs(sa, itertools.chain(resumed, batches), sa.requestAuthCodes, decode, write)
+
+    console.print(
+        f"\n[green]Saved {totals['saved']} license(s) to: [bold]{store.root}[/bold][/green]"
+    )
+    if totals["failed"]:
+        console.print(f"[red]{totals['failed']} device(s) failed")
+    console.print(
+        "\nPlease copy each file to its device & import with command: license smart import <bootflash|tftp>:<filename>"
+    )
+    return totals
+
+
+def runTenantBatches(tenant_file, batch_size, store):
+    """
+    Process for performing batch reservations for every tenant in a tenant
+    config file at once
+
+    Each tenant reserves the devices in its own inventory, with its own
+    credentials, session & caches. Licenses are saved under a directory per
+    tenant. Returns the number of tenants that failed
+    """
+    tenants = loadTenants(tenant_file)
+
+    def reserve(tenant):
+        if not tenant.inventory:
+            return None
+        return runBatch(
+            tenant.inventory, batch_size, store.forTenant(tenant.name), tenant
+        )
+
+    results = runTenants(tenants, reserve)
+    return printSummary(results, ["devices", "saved", "failed"])
+
+
+def findAuthorization(poll_data, device):
+    """
+    Locate the authorization entry for a device in a poll response
+    """
+    for authorization in poll_data["data"]["authorizations"]:
+        sudi = authorization["sudi"]
+        if (sudi["udi_pid"], sudi["udi_serial_number"]) == device.udi:
+            return authorization
+
+
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Offline Smart License reservation")
+    parser.add_argument(
+        "--inventory", help="CSV or JSON device inventory for batch reservation"
+    )
+    parser.add_argument(
+        "--tenants",
+        help="JSON tenant config file, to reserve each tenant's inventory at once",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Maximum devices per reservation request (default: 100)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="licenses",
+        help="Directory for per-device license files (default: licenses)",
+    )
+    parser.add_argument(
+        "--bundle",
+        help="Also pack this run's licenses into a single .tar.gz file for transfer",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Don't print progress to the console"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        help="Write run metrics as JSON lines & Prometheus text to this directory",
+    )
+    args = parser.parse_args()
+    setQuiet(args.quiet)
+    store = OutputStore(args.output_dir)
+    try:
+        failed = 0
+        if args.tenants:
+            failed = runTenantBatches(args.tenants, args.batch_size, store)
+        elif args.inventory:
+            runBatch(args.inventory, args.batch_size, store)
+        else:
+            run(store)
+        if args.bundle:
+            count = store.bundle(args.bundle)
+            console.print(f"Bundled {count} file(s) into: [bold]{args.bundle}")
+        if failed:
+            sys.exit(1)
+    finally:
+        if args.metrics_dir:
+            metrics.export(args.metrics_dir)
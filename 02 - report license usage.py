@@ -12,31 +12,42 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
-import json
+import argparse
+import itertools
 import os
+import shutil
 import sys
-import xml.etree.ElementTree as ET
-from base64 import b64decode, decode
+import threading
+import time
 
-from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
+from config import DEVICE_PID, DEVICE_SERIAL, LICENSE_TAGS
+from flows import checkUsage, decodeAcks, newUsage, runJobs
+from smartaccount import SmartAccount, decodeSmartLicense, setQuiet, usage_index
+from tenants import loadTenants, printSummary, runTenants
+from metrics import metrics
+from output import console
+from outputstore import OutputStore, safeName
+from preflight import (
+    PREFLIGHT_REPORT,
+    PreflightResult,
+    iterCheckedUsage,
+    writeErrorReport,
+)
+from pollscheduler import Backoff
+from transport import RateLimitError, ServerError, TransportError
+from usagereport import (
+    MAX_REQUEST_BYTES,
+    MAX_REQUEST_ITEMS,
+    buildReports,
+    chunkReports,
+    indexTaggedUsage,
+)
+from watchfolder import DirectoryWatcher, Inbox
 
-from smartaccount import LICENSE_TAG, SmartAccount
 
-# Load environment variables
-load_dotenv()
-DEVICE_SERIAL = os.getenv("DEVICE_SERIAL")
-DEVICE_PID = os.getenv("DEVICE_PID")
-DEVICE_HOSTNAME = os.getenv("DEVICE_HOSTNAME")
-LICENSE_TAG = os.getenv("LICENSE_TAG")
-
-console = Console()
-
-
-def parseXML():
+def parseXML(report_file=PREFLIGHT_REPORT):
     """
-    Read in XML usage report & locate HSEC license info
+    Read in XML usage report & locate usage info for each target license
 
     Returns report payload to upload to Smart Licensing Portal
     """
@@ -52,104 +63,474 @@ def parseXML():
     report_payloads[0] = {**sudi_info}
     # Then create a list of usage reports.
     report_payloads[0]["usage"] = []
-    # Now we'll open the usage.txt file & parse the XML to assemble usage report payload
-    with open("usage.txt", "r") as a:
-        tree = ET.parse(a).getroot()
-    # Each XML item is an individual license usage report, so we'll need to parse the actual
-    # report payload from each item
-    for item in tree.findall("./RUMReport"):
-        usage_item = json.loads(item.text)
-        payload = json.loads(usage_item["payload"])
-        # Find licenses in report that match target license tag
-        if payload["meta"]["entitlement_tag"] == LICENSE_TAG:
-            signature = usage_item["signature"]
-            # Payload attached just match EXACTLY to what we receive from the device usage report
-            # So because of python/json parsing - we need to remove any spaces & escape quotes.
-            # If this isn't exact, then payload signature will be invalid & report will be rejected
-            escaped_payload = json.dumps(payload).replace('"', '"').replace(" ", "")
-            # Add the new payload & signature info to the usage list
-            report_payloads[0]["usage"].append(
-                {"payload": escaped_payload, "signature": signature}
-            )
+    # Now we'll stream & check the usage.txt file, indexing usage items for every
+    # target license tag in a single pass. Anything older than the last
+    # acknowledged report for this device is skipped
+    udi = (DEVICE_PID, DEVICE_SERIAL)
+    usage_by_tag = indexTaggedUsage(
+        checkUsage(["usage.txt"], LICENSE_TAGS, udi, report_file),
+        usage_index.watermarks(),
+        udi,
+    )
+    for tag in LICENSE_TAGS:
+        usage = usage_by_tag.get(tag, [])
+        console.print(f"{tag}: {len(usage)} items")
+        report_payloads[0]["usage"].extend(usage)
+    # Skip anything uploaded before, since one duplicate item fails the whole report
+    new, dropped = usage_index.filterNew(
+        {(DEVICE_PID, DEVICE_SERIAL): report_payloads[0]["usage"]}
+    )
+    report_payloads[0]["usage"] = new.get((DEVICE_PID, DEVICE_SERIAL), [])
+    if dropped:
+        console.print(f"Skipping {dropped} items that were already uploaded")
 
     return report_payloads
 
 
-def run():
+def run(store, report_file=PREFLIGHT_REPORT):
     """
     Process for uploading a license usage report to Smart Licensing
 
-    This will print out & save a file locally with the Smart License usage ACK data,
-    which must be uploaded to the device
+    This will print out & save the Smart License usage ACK data to the output
+    store, which must be uploaded to the device
     """
     sa = SmartAccount()
-    console.print()
-    console.print(
-        Panel.fit(
-            "Parse XML usage report",
-            title="Step 1",
+    console.step("Parse XML usage report", "Step 1")
+    # If an earlier run was interrupted after uploading, pick up that upload
+    # rather than sending a duplicate report
+    outstanding = sa.outstandingJobs("report", (DEVICE_PID, DEVICE_SERIAL))
+    if outstanding:
+        console.print("[bold]Found an interrupted usage report upload. Resuming...")
+    else:
+        # Prompt the user to confirm the usage file has been saved locally
+        console.print(
+            "[bold]Please ensure the usage report is saved in this directory as: usage.txt"
         )
+        input("Press Enter when file is ready.")
+        report_payloads = parseXML(report_file)
+        console.print(f"\nFound {len(report_payloads[0]['usage'])} items to upload.")
+        if not report_payloads[0]["usage"]:
+            # Nothing new since the last upload isn't an error
+            console.print("[yellow]No new usage to upload.")
+            return
+
+    console.step("Authenticate to Cisco SSO", "Step 2")
+    sa.getAuthToken()
+
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 3")
+    sa.getAccountIDs()
+
+    console.step("Upload License Usage Report", "Step 4")
+    if outstanding:
+        poll_id = outstanding[-1].poll_id
+        headers = outstanding[-1].headers
+        console.print(f"Resuming earlier upload. Poll ID: {poll_id}")
+    else:
+        poll_id = sa.sendUsageReport(report_payloads, DEVICE_PID, DEVICE_SERIAL)
+        if not poll_id:
+            sys.exit(1)
+        headers = sa.device_headers
+
+    console.step("Check Request Status", "Step 5")
+    poll_data = sa.getPollRequest(poll_id, "acknowledgements", headers)
+    if not poll_data:
+        # Failed or timed out, the error was printed while polling
+        sys.exit(1)
+
+    # Parse acknowledgement response
+    try:
+        ack_data = decodeSmartLicense(
+            poll_data["data"]["acknowledgements"][0]["smart_license"]
+        )
+    except ValueError as e:
+        console.print(f"\n[red]{e}")
+        sys.exit(1)
+    # Save to local file & print out next steps
+    filename = store.save(
+        "ack", DEVICE_PID, DEVICE_SERIAL, poll_id, ack_data, LICENSE_TAGS
     )
-    # Prompt the user to confirm the usage file has been saved locally
+    console.print(f"\nACK saved to: [bold]{filename}")
     console.print(
-        "[bold]Please ensure the usage report is saved in this directory as: usage.txt"
+        f"\nPlease copy file to device & import with command: license smart import <bootflash|tftp>:{os.path.basename(filename)}"
     )
-    input("Press Enter when file is ready.")
-    report_payloads = parseXML()
-    console.print(f"\nFound {len(report_payloads[0]['usage'])} items to upload.")
 
-    console.print()
+
+def uploadReports(sa, chunks, resumed, store):
+    """
+    Upload usage report chunks & save each device's ACK to the output store
+
+    Chunks are uploaded, polled, decoded & saved in separate pipeline stages,
+    so ACKs are written out as soon as each upload is acknowledged while
+    others are still being polled. Resumed jobs go straight to polling.
+    Returns (number of uploads accepted, list of saved file names, list of
+    error messages for uploads that failed or device reports that were rejected)
+    """
+    lock = threading.Lock()
+    uploads = len(resumed)
+    saved = []
+    errors = []
+
+    def submit(chunk):
+        nonlocal uploads
+        jobs, rejected = sa.sendUsageReports([chunk])
+        with lock:
+            uploads += len(jobs)
+            errors.extend(
+                f"{report['sudi']['udi_pid']} - SN: {report['sudi']['udi_serial_number']}: usage report rejected"
+                for report in rejected
+            )
+        return jobs
+
+    def decode(result):
+        job, poll_data = result
+        if not poll_data:
+            console.print(f"[red]No result for Poll ID {job.poll_id}: {job.error}")
+            with lock:
+                errors.append(f"Poll ID {job.poll_id}: {job.error}")
+            return []
+        acks, failed = decodeAcks(job, poll_data)
+        for udi, error in failed:
+            console.print(f"[red]{udi[0]} - SN: {udi[1]}: {error}")
+            with lock:
+                errors.append(f"{udi[0]} - SN: {udi[1]}: {error}")
+        # Each device in the chunk gets its own ACK
+        return [(job, udi, ack_data, tags) for udi, ack_data, tags in acks]
+
+    def write(item):
+        job, udi, ack_data, tags = item
+        path = store.save("ack", *udi, job.poll_id, ack_data, tags)
+        with lock:
+            saved.append(path)
+
+    runJobs(sa, itertools.chain(resumed, chunks), submit, decode, write, fan_out=True)
+    return uploads, saved, errors
+
+
+def runAggregate(
+    usage_files, max_bytes, max_items, store, tenant=None, report_file=PREFLIGHT_REPORT
+):
+    """
+    Process for uploading usage reports for many devices at once
+
+    Usage items from all files are grouped by device & uploaded in as few
+    requests as the size limits allow. Items that fail pre-flight checks are
+    listed in report_file & left out. Each device ACK is saved to the output
+    store. Uses the tenant's credentials & accounts if given, otherwise those
+    in .env. Returns dict of upload counts
+    """
+    sa = SmartAccount(tenant)
+    console.step("Parse XML usage reports", "Step 1")
+    # Only usage that passes pre-flight checks & is newer than each device's
+    # last acknowledged report is kept
+    udi = (DEVICE_PID, DEVICE_SERIAL)
+    items = checkUsage(usage_files, sa.tenant.license_tags, udi, report_file)
+    # Devices with an upload left outstanding by an interrupted run are polled
+    # again rather than uploaded twice
+    resumed = sa.outstandingJobs("report")
+    devices, dropped = newUsage(sa, items, udi, resumed)
+    chunks = list(chunkReports(buildReports(devices), max_bytes, max_items))
+    item_count = sum(len(usage) for usage in devices.values())
     console.print(
-        Panel.fit(
-            "Authenticate to Cisco SSO",
-            title="Step 2",
-        )
+        f"\nFound {item_count} items for {len(devices)} device(s) in {len(usage_files)} file(s)."
     )
+    if dropped:
+        console.print(f"Skipping {dropped} items that were already uploaded.")
+    totals = {"items": item_count, "uploads": 0, "acks": 0, "failed": 0}
+    if not chunks and not resumed:
+        console.print("[yellow]No new usage to upload.")
+        return totals
+    console.print(f"Uploading in {len(chunks)} request(s).")
+    if resumed:
+        console.print(f"Resuming {len(resumed)} outstanding upload(s).")
+
+    console.step("Authenticate to Cisco SSO", "Step 2")
     sa.getAuthToken()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Locate Smart Account & Virtual Account IDs",
-            title="Step 3",
-        )
-    )
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 3")
     sa.getAccountIDs()
 
-    console.print()
+    console.step("Upload License Usage Reports & Save ACKs", "Step 4")
+    uploads, saved, errors = uploadReports(sa, chunks, resumed, store)
+    totals["uploads"] = uploads
+    totals["failed"] = len(errors)
+    if errors:
+        console.print(f"[red]{len(errors)} upload(s) or device report(s) failed")
+    if not uploads:
+        return totals
+    console.print(f"\n[green]Saved {len(saved)} ACK(s) to: [bold]{store.root}")
     console.print(
-        Panel.fit(
-            "Upload License Usage Report",
-            title="Step 4",
-        )
+        "\nPlease copy each file to its device & import with command: license smart import <bootflash|tftp>:<filename>"
     )
-    poll_id = sa.sendUsageReport(report_payloads, DEVICE_PID, DEVICE_SERIAL)
-    if not poll_id:
-        sys.exit(1)
+    totals["acks"] = len(saved)
+    return totals
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Check Request Status",
-            title="Step 5",
+
+def runTenantReports(tenant_file, max_bytes, max_items, store, report_file):
+    """
+    Process for uploading usage reports for every tenant in a tenant config
+    file at once
+
+    Each tenant uploads its own usage files, with its own credentials, session
+    & caches. ACKs are saved under a directory per tenant. Each tenant's
+    pre-flight report is saved next to report_file, with the tenant name added.
+    Returns the number of tenants that failed
+    """
+    tenants = loadTenants(tenant_file)
+    stem, extension = os.path.splitext(report_file)
+
+    def report(tenant):
+        if not tenant.usage_files:
+            return None
+        return runAggregate(
+            tenant.usage_files,
+            max_bytes,
+            max_items,
+            store.forTenant(tenant.name),
+            tenant,
+            f"{stem}_{safeName(tenant.name)}{extension}",
         )
+
+    results = runTenants(tenants, report)
+    return printSummary(results, ["items", "uploads", "acks", "failed"])
+
+
+def processUsageFile(sa, path, outbox, max_bytes, max_items):
+    """
+    Upload a usage file claimed from the watch folder & save its ACKs
+
+    ACKs are written to a new directory in outbox named after the file, along
+    with the usage file itself & a report of any items that failed pre-flight
+    checks. If some items are bad or some uploads or device reports are
+    rejected, ACKs for the rest are kept in a "_partial" directory. The
+    directory is built under a temporary name & renamed into place, so anything
+    watching the outbox only sees finished results.
+    Returns the output directory. Raises RuntimeError if any item or upload failed
+    """
+    name = os.path.basename(path)
+    temp_dir = os.path.join(outbox, f".tmp_{name}")
+    udi = (DEVICE_PID, DEVICE_SERIAL)
+    result = PreflightResult()
+    items = iterCheckedUsage([path], result, sa.tenant.license_tags, udi, workers=1)
+    devices, dropped = newUsage(sa, items, udi)
+    item_count = sum(len(usage) for usage in devices.values())
+    console.print(
+        f"{name}: {item_count} new items for {len(devices)} device(s), {dropped} already uploaded"
     )
-    poll_data = sa.getPollRequest(poll_id, "acknowledgements")
+    chunks = list(chunkReports(buildReports(devices), max_bytes, max_items))
+    store = OutputStore(temp_dir)
+    uploads, saved, errors = uploadReports(sa, chunks, [], store)
+    if result.errors:
+        # The report goes in the output directory, so it's kept with the ACKs
+        report_file = os.path.join(temp_dir, PREFLIGHT_REPORT)
+        os.makedirs(temp_dir, exist_ok=True)
+        writeErrorReport(report_file, result.errors)
+        first = result.errors[0]
+        errors.append(
+            f"{len(result.errors)} item(s) failed pre-flight checks, first: item {first['item']}: {first['error']}"
+        )
+    output_dir = os.path.join(outbox, f"{name}_{time.strftime('%Y%m%d%H%M%S')}")
+    if errors:
+        # Keep any ACKs we did get, & the pre-flight report. Those items won't
+        # be uploaded again
+        if saved or result.errors:
+            os.rename(temp_dir, output_dir + "_partial")
+        else:
+            shutil.rmtree(temp_dir)
+        raise RuntimeError("; ".join(errors))
+    shutil.move(path, os.path.join(temp_dir, name))
+    os.rename(temp_dir, output_dir)
+    console.print(f"[green]{name}: saved {len(saved)} ACK(s) to: [bold]{output_dir}")
+    return output_dir
 
-    # Parse acknowledgement response
-    ack_data = b64decode(
-        poll_data["data"]["acknowledgements"][0]["smart_license"]
-    ).decode("utf-8")
-    console.print("\nLicense ACK Data:")
-    console.print(f"{ack_data}", markup=False, soft_wrap=True)
-    # Save to local file & print out next steps
-    with open("ACK.txt", "w") as a:
-        a.write(ack_data)
-        console.print("\nACK saved to: [bold]ACK.txt")
+
+def runDaemon(inbox_dir, outbox_dir, workers, max_bytes, max_items):
+    """
+    Long-running process that uploads usage files as they are dropped into a
+    watch folder
+
+    Files are claimed from inbox_dir & processed on a pool of worker threads,
+    which share a single access token & account lookup. Results are written to
+    outbox_dir. No new files are claimed while every worker is busy, or for a
+    while after the API throttles or fails a request
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    sa = SmartAccount()
+    inbox = Inbox(inbox_dir)
+    os.makedirs(outbox_dir, exist_ok=True)
+    # Files claimed by an interrupted daemon go back in the queue. Anything they
+    # already uploaded is skipped by the usage index & polled again below
+    recovered = inbox.recover()
+    if recovered:
+        console.print(f"Recovered {len(recovered)} file(s) from an interrupted run")
+    sa.getAuthToken()
+    sa.getAccountIDs()
+    resumed = sa.outstandingJobs("report")
+    if resumed:
+        console.print(f"Resuming {len(resumed)} outstanding upload(s)")
+        store = OutputStore(
+            os.path.join(outbox_dir, f"resumed_{time.strftime('%Y%m%d%H%M%S')}")
+        )
+        uploadReports(sa, [], resumed, store)
+
+    watcher = DirectoryWatcher(inbox_dir)
     console.print(
-        "\nPlease copy file to device & import with command: license smart import <bootflash|tftp>:ACK.txt"
+        f"\nWatching [bold]{inbox_dir}[/bold] ({watcher.mode}) with {workers} worker(s). Press Ctrl+C to stop."
     )
+    slots = threading.BoundedSemaphore(workers)
+    lock = threading.Lock()
+    backoff = Backoff(initial=5.0, max_delay=300.0)
+    paused_until = 0.0
+
+    def work(path):
+        nonlocal paused_until
+        name = os.path.basename(path)
+        try:
+            processUsageFile(sa.clone(), path, outbox_dir, max_bytes, max_items)
+            with lock:
+                backoff.attempts = 0
+        except (TransportError, RateLimitError, ServerError) as e:
+            # The API is struggling, so put the file back & ease off for a while
+            inbox.release(path)
+            with lock:
+                delay = backoff.next()
+                paused_until = max(paused_until, time.monotonic() + delay)
+            console.print(f"[yellow]{name}: {e}. Retrying in {delay:.0f} seconds")
+        except Exception as e:
+            inbox.fail(path, e)
+            console.print(f"[red]{name}: failed: {e}")
+        finally:
+            slots.release()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            names, next_ready = inbox.pending()
+            for name in names:
+                if time.monotonic() < paused_until:
+                    break
+                # Blocks while every worker is busy, so files wait in the inbox
+                slots.acquire()
+                path = inbox.claim(name)
+                if path:
+                    executor.submit(work, path)
+                else:
+                    slots.release()
+            timeouts = [60.0]
+            if next_ready is not None:
+                timeouts.append(next_ready)
+            if paused_until > time.monotonic():
+                timeouts.append(paused_until - time.monotonic())
+            watcher.wait(max(min(timeouts), 0.1))
+    except KeyboardInterrupt:
+        console.print("\nStopping. Waiting for files in progress to finish...")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        watcher.close()
+        inbox.close()
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Smart License usage reporting")
+    parser.add_argument(
+        "--usage-files",
+        nargs="+",
+        help="Usage files to aggregate into multi-device reports",
+    )
+    parser.add_argument(
+        "--tenants",
+        help="JSON tenant config file, to upload each tenant's usage files at once",
+    )
+    parser.add_argument(
+        "--max-request-bytes",
+        type=int,
+        default=MAX_REQUEST_BYTES,
+        help=f"Maximum usage data per upload request (default: {MAX_REQUEST_BYTES})",
+    )
+    parser.add_argument(
+        "--max-request-items",
+        type=int,
+        default=MAX_REQUEST_ITEMS,
+        help=f"Maximum usage items per upload request (default: {MAX_REQUEST_ITEMS})",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="acks",
+        help="Directory for per-device ACK files (default: acks)",
+    )
+    parser.add_argument(
+        "--bundle",
+        help="Also pack this run's ACKs into a single .tar.gz file for transfer",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="INBOX",
+        help="Run as a daemon, uploading usage files as they are dropped into INBOX",
+    )
+    parser.add_argument(
+        "--outbox",
+        default="outbox",
+        help="Directory for results of watched usage files (default: outbox)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Usage files to process at the same time in watch mode (default: 4)",
+    )
+    parser.add_argument(
+        "--preflight-report",
+        default=PREFLIGHT_REPORT,
+        help=f"CSV report of usage items that fail pre-flight checks (default: {PREFLIGHT_REPORT})",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Don't print progress to the console"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        help="Write run metrics as JSON lines & Prometheus text to this directory",
+    )
+    args = parser.parse_args()
+    if args.tenants and args.watch:
+        parser.error("--tenants can't be used with --watch")
+    setQuiet(args.quiet)
+    try:
+        if args.watch:
+            runDaemon(
+                args.watch,
+                args.outbox,
+                args.workers,
+                args.max_request_bytes,
+                args.max_request_items,
+            )
+        else:
+            store = OutputStore(args.output_dir)
+            failed = 0
+            if args.tenants:
+                failed = runTenantReports(
+                    args.tenants,
+                    args.max_request_bytes,
+                    args.max_request_items,
+                    store,
+                    args.preflight_report,
+                )
+            elif args.usage_files:
+                totals = runAggregate(
+                    args.usage_files,
+                    args.max_request_bytes,
+                    args.max_request_items,
+                    store,
+                    report_file=args.preflight_report,
+                )
+                # Only failed uploads are an error, not having nothing new to send
+                failed = totals["failed"]
+            else:
+                run(store, args.preflight_report)
+            if args.bundle:
+                count = store.bundle(args.bundle)
+                console.print(f"Bundled {count} file(s) into: [bold]{args.bundle}")
+            if failed:
+                sys.exit(1)
+    finally:
+        if args.metrics_dir:
+            metrics.export(args.metrics_dir)
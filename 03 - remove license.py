@@ -12,75 +12,66 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import argparse
+import csv
+import itertools
 import os
-from base64 import b64decode, decode
+import sys
+import threading
 
-from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
-
-from smartaccount import SmartAccount
-
-# Load environment variables
-load_dotenv()
-DEVICE_SERIAL = os.getenv("DEVICE_SERIAL")
-DEVICE_PID = os.getenv("DEVICE_PID")
-DEVICE_HOSTNAME = os.getenv("DEVICE_HOSTNAME")
-
-console = Console()
+from config import DEVICE_HOSTNAME, DEVICE_PID, DEVICE_SERIAL
+from flows import runJobs
+from inventory import Device, batched, loadRemovals
+from metrics import metrics
+from output import console
+from outputstore import safeName
+from smartaccount import SmartAccount, setQuiet
+from tenants import loadTenants, printSummary, runTenants
 
 
 def run():
     """
     Process for removing a device license reservation
     """
-    # Get License removal code:
-    console.print(
-        "\nTo remove a device license reservation, we need a device removal code."
-    )
-    console.print("This can be collected from the device with the following command: ")
-    console.print("[bold]router# license smart authorization return local online")
-    console.print("\nPlease enter device removal code:")
-    remove_code = (input("> ")).strip()
     sa = SmartAccount()
-
-    console.print()
-    console.print(
-        Panel.fit(
-            "Authenticate to Cisco SSO",
-            title="Step 1",
+    # If an earlier run was interrupted, pick up its request rather than
+    # submitting the removal again
+    outstanding = sa.outstandingJobs("remove", (DEVICE_PID, DEVICE_SERIAL))
+    if outstanding:
+        console.print("[bold]Found an interrupted removal request. Resuming...")
+    else:
+        # Get License removal code:
+        console.print(
+            "\nTo remove a device license reservation, we need a device removal code."
         )
-    )
+        console.print(
+            "This can be collected from the device with the following command: "
+        )
+        console.print("[bold]router# license smart authorization return local online")
+        console.print("\nPlease enter device removal code:")
+        remove_code = (input("> ")).strip()
+
+    console.step("Authenticate to Cisco SSO", "Step 1")
     sa.getAuthToken()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Locate Smart Account & Virtual Account IDs",
-            title="Step 2",
-        )
-    )
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 2")
     sa.getAccountIDs()
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Send License Removal Request",
-            title="Step 3",
+    console.step("Send License Removal Request", "Step 3")
+    if outstanding:
+        job = outstanding[-1]
+        console.print(f"Resuming earlier request. Poll ID: {job.poll_id}")
+    else:
+        device = Device(
+            DEVICE_PID, DEVICE_SERIAL, DEVICE_HOSTNAME, remove_code=remove_code
         )
-    )
-    poll_id = sa.removeDeviceLicense(
-        DEVICE_PID, DEVICE_SERIAL, DEVICE_HOSTNAME, remove_code
-    )
+        job = sa.removeDeviceLicenses([device])
 
-    console.print()
-    console.print(
-        Panel.fit(
-            "Check Request Status",
-            title="Step 4",
-        )
-    )
-    status = sa.getPollRequest(poll_id, "authorizations")
+    console.step("Check Request Status", "Step 4")
+    status = sa.getPollRequest(job.poll_id, "authorizations", job.headers)
+    if not status:
+        # Failed or timed out, the error was printed while polling
+        sys.exit(1)
 
     # The removal task doesn't give us much status, except whether or not the removal failed or succeeded
     for device in status["data"]["authorizations"]:
@@ -95,5 +86,156 @@ def run():
             )
 
 
+def runBulk(removal_file, batch_size, report_file, tenant=None):
+    """
+    Process for removing license reservations from many devices at once
+
+    Removal codes are read from a file & packed into batched requests. A
+    per-device status report is saved to report_file. Uses the tenant's
+    credentials & accounts if given, otherwise those in .env.
+    Returns dict of device counts
+    """
+    sa = SmartAccount(tenant)
+    devices = loadRemovals(removal_file)
+    # Skip devices that already have a removal in progress
+    resumed = sa.outstandingJobs("remove")
+    pending = {device.udi for job in resumed for device in job.context}
+    batches = list(
+        batched([device for device in devices if device.udi not in pending], batch_size)
+    )
+    console.print(
+        f"Loaded {len(devices)} removal codes from {removal_file} ({len(batches)} batches)"
+    )
+    if resumed:
+        console.print(f"Resuming {len(resumed)} outstanding request(s)")
+
+    console.step("Authenticate to Cisco SSO", "Step 1")
+    sa.getAuthToken()
+
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 2")
+    sa.getAccountIDs()
+
+    console.step("Send License Removal Requests & Save Results", "Step 3")
+    totals = {"devices": len(devices), "removed": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def decode(result):
+        job, status = result
+        if not status:
+            # Whole request failed, so every device in it failed
+            return [
+                [device.pid, device.serial, "FAILED", "", job.error]
+                for device in job.context
+            ]
+        # The removal task doesn't give us much status, except whether or not the removal failed or succeeded
+        return [
+            [
+                device["sudi"]["udi_pid"],
+                device["sudi"]["udi_serial_number"],
+                device["status"],
+                device["error_code"] or "",
+                device["status_message"] or "",
+            ]
+            for device in status["data"]["authorizations"]
+        ]
+
+    with open(report_file, "w", newline="") as a:
+        writer = csv.writer(a)
+        writer.writerow(["pid", "serial", "status", "error_code", "status_message"])
+
+        def write(result):
+            # Each device's result is added to the report as soon as it's known
+            pid, serial, status, error_code, status_message = result
+            failed = error_code or status == "FAILED"
+            if failed:
+                console.print(
+                    f"[red]{pid} - SN: {serial}: Error: {error_code} - {status_message}"
+                )
+            else:
+                console.print(f"[green]{pid} - SN: {serial}: {status}")
+            with lock:
+                writer.writerow(result)
+                totals["failed" if failed else "removed"] += 1
+
+        runJobs(
+            sa,
+            itertools.chain(resumed, batches),
+            sa.removeDeviceLicenses,
+            decode,
+            write,
+        )
+
+    console.print(
+        f"\n{totals['removed']} removed, {totals['failed']} failed. Report saved to: [bold]{report_file}"
+    )
+    return totals
+
+
+def runTenantRemovals(tenant_file, batch_size, report_file):
+    """
+    Process for removing license reservations for every tenant in a tenant
+    config file at once
+
+    Each tenant removes the devices in its own removal file, with its own
+    credentials, session & caches. Each tenant's status report is saved next
+    to report_file, with the tenant name added. Returns the number of tenants
+    that failed
+    """
+    tenants = loadTenants(tenant_file)
+    stem, extension = os.path.splitext(report_file)
+
+    def remove(tenant):
+        if not tenant.removal_file:
+            return None
+        return runBulk(
+            tenant.removal_file,
+            batch_size,
+            f"{stem}_{safeName(tenant.name)}{extension}",
+            tenant,
+        )
+
+    results = runTenants(tenants, remove)
+    return printSummary(results, ["devices", "removed", "failed"])
+
+
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Smart License reservation removal")
+    parser.add_argument(
+        "--removal-file",
+        help="CSV or JSON file of pid, serial, hostname & remove_code for bulk removal",
+    )
+    parser.add_argument(
+        "--tenants",
+        help="JSON tenant config file, to process each tenant's removal file at once",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Maximum devices per removal request (default: 100)",
+    )
+    parser.add_argument(
+        "--report",
+        default="removal_report.csv",
+        help="Per-device result file for bulk removal (default: removal_report.csv)",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Don't print progress to the console"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        help="Write run metrics as JSON lines & Prometheus text to this directory",
+    )
+    args = parser.parse_args()
+    setQuiet(args.quiet)
+    try:
+        if args.tenants:
+            if runTenantRemovals(args.tenants, args.batch_size, args.report):
+                sys.exit(1)
+        elif args.removal_file:
+            runBulk(args.removal_file, args.batch_size, args.report)
+        else:
+            run()
+    finally:
+        if args.metrics_dir:
+            metrics.export(args.metrics_dir)
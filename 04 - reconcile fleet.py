@@ -0,0 +1,379 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import threading
+
+from config import DEVICE_PID, DEVICE_SERIAL
+from flows import checkUsage, decodeAcks, newUsage, runJobs
+from inventory import batched, loadInventory, loadRemovals
+from metrics import metrics
+from output import console
+from outputstore import OutputStore, safeName
+from planner import planFleet
+from preflight import PREFLIGHT_REPORT
+from reservationindex import succeeded
+from smartaccount import SmartAccount, decodeSmartLicense, setQuiet
+from tenants import loadTenants, printSummary, runTenants
+from usagereport import MAX_REQUEST_BYTES, MAX_REQUEST_ITEMS, buildReports, chunkReports
+
+# Kinds of request a plan can include, in the order they are applied
+KINDS = ("remove", "reserve", "report")
+
+
+def printPlan(plan, resumed):
+    """
+    Print a summary of a plan & anything that's blocked
+    """
+    console.print(
+        f"Plan: {len(plan.returns)} device(s) to return, {len(plan.reserve)} to"
+        f" reserve & {len(plan.reports)} usage upload(s). {plan.unchanged}"
+        f" device(s) unchanged, {plan.in_progress} in progress, {len(plan.blocked)}"
+        " blocked"
+    )
+    outstanding = sum(len(jobs) for jobs in resumed.values())
+    if outstanding:
+        console.print(f"Resuming {outstanding} outstanding request(s)")
+    for device, reason in plan.blocked[:10]:
+        console.print(f"[yellow]{device.pid} - SN: {device.serial}: {reason}")
+    if len(plan.blocked) > 10:
+        console.print(f"[yellow]...& {len(plan.blocked) - 10} more blocked device(s)")
+
+
+def reconcile(
+    inventory_file,
+    removal_file,
+    usage_files,
+    batch_size,
+    store,
+    dry_run=False,
+    tenant=None,
+    report_file=PREFLIGHT_REPORT,
+):
+    """
+    Process for bringing a fleet in line with a desired-state inventory
+
+    The inventory is compared with the reservation index, & only the
+    reservations, returns & usage uploads needed to match it are sent. Returns
+    use the remove codes in removal_file. Licenses & ACKs are saved to the
+    output store. If nothing has changed since the last run, no requests are
+    made at all. Uses the tenant's credentials & accounts if given, otherwise
+    those in .env. Returns dict of device counts
+    """
+    sa = SmartAccount(tenant)
+    console.step("Plan Fleet Changes", "Step 1")
+    desired = loadInventory(inventory_file, default_entitlements=sa.tenant.license_tags)
+    removal_codes = {}
+    if removal_file:
+        removal_codes = {device.udi: device for device in loadRemovals(removal_file)}
+    # Requests left outstanding by an interrupted run are polled again rather
+    # than planned & submitted twice
+    resumed = {kind: sa.outstandingJobs(kind) for kind in KINDS}
+    in_progress = {
+        device.udi
+        for kind in ("remove", "reserve")
+        for job in resumed[kind]
+        for device in job.context
+    }
+    reports = []
+    if usage_files:
+        # Only usage that hasn't been uploaded yet is planned. Devices with an
+        # upload still outstanding are picked up when it's resumed
+        udi = (DEVICE_PID, DEVICE_SERIAL)
+        items = checkUsage(usage_files, sa.tenant.license_tags, udi, report_file)
+        devices, _ = newUsage(sa, items, udi, resumed["report"])
+        reports = list(
+            chunkReports(buildReports(devices), MAX_REQUEST_BYTES, MAX_REQUEST_ITEMS)
+        )
+    plan = planFleet(
+        desired,
+        sa.reservations.reserved(sa.tenant.name),
+        sa.tenant.virtual_account,
+        removal_codes,
+        in_progress,
+        reports,
+    )
+    printPlan(plan, resumed)
+    totals = {
+        "devices": len(desired),
+        "returned": 0,
+        "reserved": 0,
+        "acks": 0,
+        "blocked": len(plan.blocked),
+        "failed": 0,
+    }
+    if dry_run:
+        return totals
+    if plan.empty and not any(resumed.values()):
+        if plan.blocked:
+            console.print(
+                "[yellow]Nothing else can change until blocked devices are fixed."
+            )
+        else:
+            console.print("[green]Fleet already matches the inventory. Nothing to do.")
+        return totals
+
+    console.step("Authenticate to Cisco SSO", "Step 2")
+    sa.getAuthToken()
+
+    console.step("Locate Smart Account & Virtual Account IDs", "Step 3")
+    sa.getAccountIDs()
+
+    lock = threading.Lock()
+    # UDIs whose licenses Smart Licensing confirmed as returned
+    returned = set()
+
+    def count(key, value=1):
+        with lock:
+            totals[key] += value
+
+    def failed(job):
+        # Whole request failed, so every device in it failed
+        console.print(f"[red]No result for Poll ID {job.poll_id}: {job.error}")
+        count("failed", len(job.context))
+        return []
+
+    def decodeRemovals(result):
+        job, status = result
+        if not status:
+            return failed(job)
+        for device in status["data"]["authorizations"]:
+            sudi = device["sudi"]
+            if succeeded(device):
+                console.print(
+                    f"[green]{sudi['udi_pid']} - SN: {sudi['udi_serial_number']}: Returned"
+                )
+                with lock:
+                    returned.add((sudi["udi_pid"], sudi["udi_serial_number"]))
+                count("returned")
+            else:
+                console.print(
+                    f"[red]{sudi['udi_pid']} - SN: {sudi['udi_serial_number']}: Error:"
+                    f" {device['error_code']} - {device['status_message']}"
+                )
+                count("failed")
+        return []
+
+    def decodeLicenses(result):
+        job, poll_data = result
+        if not poll_data:
+            return failed(job)
+        authorizations = {
+            (auth["sudi"]["udi_pid"], auth["sudi"]["udi_serial_number"]): auth
+            for auth in poll_data["data"]["authorizations"]
+        }
+        licenses = []
+        for device in job.context:
+            device_auth = authorizations.get(device.udi)
+            try:
+                if not device_auth or not succeeded(device_auth):
+                    raise ValueError(
+                        device_auth["status_message"] if device_auth else "Missing"
+                    )
+                license_key = decodeSmartLicense(device_auth["smart_license"])
+            except ValueError as e:
+                console.print(f"[red]{device.pid} - SN: {device.serial}: {e}")
+                count("failed")
+                continue
+            licenses.append(("lic", device.udi, job, license_key, device.entitlements))
+        return licenses
+
+    def decodeReports(result):
+        job, poll_data = result
+        if not poll_data:
+            return failed(job)
+        acks, errors = decodeAcks(job, poll_data)
+        for udi, error in errors:
+            console.print(f"[red]{udi[0]} - SN: {udi[1]}: {error}")
+            count("failed")
+        return [("ack", udi, job, ack_data, tags) for udi, ack_data, tags in acks]
+
+    def submitReports(chunk):
+        jobs, rejected = sa.sendUsageReports([chunk])
+        count("failed", len(rejected))
+        return jobs
+
+    def write(item):
+        kind, udi, job, data, entitlements = item
+        store.save(kind, *udi, job.poll_id, data, entitlements)
+        count("reserved" if kind == "lic" else "acks")
+
+    # Licenses are returned before anything is reserved, so a device being
+    # moved or changed is free to be reserved again
+    if plan.returns or resumed["remove"]:
+        console.step("Return Licenses", "Step 4")
+        runJobs(
+            sa,
+            itertools.chain(resumed["remove"], batched(plan.returns, batch_size)),
+            sa.removeDeviceLicenses,
+            decodeRemovals,
+            write,
+        )
+    # A device whose return failed or got no answer still holds its old
+    # reservation, so reserving it again would add on top of that
+    unreturned = {device.udi for device in plan.returns} - returned
+    reserve = [device for device in plan.reserve if device.udi not in unreturned]
+    for device in plan.reserve:
+        if device.udi in unreturned:
+            console.print(
+                f"[yellow]{device.pid} - SN: {device.serial}: Not reserved again"
+                " until its licenses are returned"
+            )
+    if reserve or resumed["reserve"]:
+        console.step("Reserve & Save Licenses", "Step 5")
+        runJobs(
+            sa,
+            itertools.chain(resumed["reserve"], batched(reserve, batch_size)),
+            sa.requestAuthCodes,
+            decodeLicenses,
+            write,
+        )
+    if plan.reports or resumed["report"]:
+        console.step("Upload Usage Reports & Save ACKs", "Step 6")
+        runJobs(
+            sa,
+            itertools.chain(resumed["report"], plan.reports),
+            submitReports,
+            decodeReports,
+            write,
+            fan_out=True,
+        )
+
+    console.print(
+        f"\n{totals['returned']} returned, {totals['reserved']} license(s) &"
+        f" {totals['acks']} ACK(s) saved to: [bold]{store.root}"
+    )
+    if totals["failed"]:
+        console.print(f"[red]{totals['failed']} device(s) failed")
+    return totals
+
+
+def runTenantReconcile(tenant_file, batch_size, store, dry_run, report_file):
+    """
+    Process for reconciling every tenant in a tenant config file at once
+
+    Each tenant's inventory, removal file & usage files are planned & applied
+    with its own credentials, session & caches. Output is saved under a
+    directory per tenant. Returns the number of tenants that failed
+    """
+    tenants = loadTenants(tenant_file)
+    stem, extension = os.path.splitext(report_file)
+
+    def work(tenant):
+        if not tenant.inventory:
+            return None
+        return reconcile(
+            tenant.inventory,
+            tenant.removal_file,
+            tenant.usage_files,
+            batch_size,
+            store.forTenant(tenant.name),
+            dry_run,
+            tenant,
+            f"{stem}_{safeName(tenant.name)}{extension}",
+        )
+
+    results = runTenants(tenants, work)
+    return printSummary(
+        results, ["devices", "returned", "reserved", "acks", "blocked", "failed"]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reconcile Smart License reservations with a device inventory"
+    )
+    parser.add_argument(
+        "--inventory",
+        help="CSV or JSON inventory of every device & what it should have",
+    )
+    parser.add_argument(
+        "--removals",
+        help="CSV or JSON remove codes for devices whose licenses need returning",
+    )
+    parser.add_argument(
+        "--usage-files", nargs="+", help="Usage files to upload any new usage from"
+    )
+    parser.add_argument(
+        "--tenants",
+        help="JSON tenant config file, to reconcile each tenant's inventory at once",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Maximum devices per reservation or removal request (default: 100)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="fleet",
+        help="Directory for per-device license & ACK files (default: fleet)",
+    )
+    parser.add_argument(
+        "--bundle",
+        help="Also pack this run's licenses & ACKs into a single .tar.gz file for transfer",
+    )
+    parser.add_argument(
+        "--preflight-report",
+        default=PREFLIGHT_REPORT,
+        help=f"CSV report of usage items that fail pre-flight checks (default: {PREFLIGHT_REPORT})",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the plan, without contacting Smart Licensing",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Don't print progress to the console"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        help="Write run metrics as JSON lines & Prometheus text to this directory",
+    )
+    args = parser.parse_args()
+    if not args.inventory and not args.tenants:
+        parser.error("--inventory or --tenants is required")
+    setQuiet(args.quiet)
+    store = OutputStore(args.output_dir)
+    try:
+        if args.tenants:
+            failed = runTenantReconcile(
+                args.tenants,
+                args.batch_size,
+                store,
+                args.dry_run,
+                args.preflight_report,
+            )
+        else:
+            totals = reconcile(
+                args.inventory,
+                args.removals,
+                args.usage_files,
+                args.batch_size,
+                store,
+                args.dry_run,
+                report_file=args.preflight_report,
+            )
+            failed = totals["failed"]
+        if args.bundle and not args.dry_run:
+            count = store.bundle(args.bundle)
+            console.print(f"Bundled {count} file(s) into: [bold]{args.bundle}")
+        if failed:
+            sys.exit(1)
+    finally:
+        if args.metrics_dir:
+            metrics.export(args.metrics_dir)
@@ -0,0 +1,172 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+import threading
+import time
+
+from storage import readJSON, writeJSONAtomic
+
+DEFAULT_INDEX_FILE = os.path.join("~", ".smartlicensing", "account_index.json")
+
+# How long a downloaded account list is trusted, in seconds
+DEFAULT_TTL = 24 * 60 * 60
+
+# Bumped when the saved layout changes, so older indexes are re-downloaded
+INDEX_VERSION = 2
+
+
+class AccountLookupError(LookupError):
+    """
+    Raised when a Smart Account or Virtual Account can't be found
+    """
+
+
+class AccountIndex:
+    """
+    Local index of Smart Account & Virtual Account IDs
+
+    Built from the v2/accounts/search response & keyed by SA domain and VA
+    name, so lookups are a dictionary hit instead of a scan over every account.
+    Names are matched exactly first, then case-insensitively unless two names
+    differ only in case. Indexes are saved to disk per API client ID & reused
+    until the TTL runs out.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = os.path.expanduser(path or DEFAULT_INDEX_FILE)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.indexes = None
+
+    def build(self, client_id, accounts):
+        """
+        Index the "accounts" list from a v2/accounts/search response & save it
+        """
+        index = {"version": INDEX_VERSION, "fetched_at": time.time(), "accounts": {}}
+        for smart_account in accounts:
+            virtual_accounts = {
+                virtual_account["name"]: virtual_account["virtual_account_id"]
+                for virtual_account in smart_account.get("virtual_accounts", [])
+            }
+            index["accounts"][smart_account["domain"]] = {
+                "account_id": smart_account["account_id"],
+                "domain": smart_account["domain"],
+                "virtual_accounts": virtual_accounts,
+                "folded": foldNames(virtual_accounts),
+            }
+        index["folded"] = foldNames(index["accounts"])
+        with self.lock:
+            indexes = self.load()
+            indexes[client_id] = index
+            writeJSONAtomic(self.path, indexes)
+        return index
+
+    def get(self, client_id):
+        """
+        Returns the saved index for client_id, or None if missing or older than the TTL
+        """
+        with self.lock:
+            index = self.load().get(client_id)
+        if (
+            not index
+            or index.get("version") != INDEX_VERSION
+            or time.time() - index["fetched_at"] > self.ttl
+        ):
+            return None
+        return index
+
+    def invalidate(self, client_id=None):
+        """
+        Force the next lookup to re-download account info. Clears all
+        clients if client_id isn't given
+        """
+        with self.lock:
+            indexes = self.load()
+            if client_id is None:
+                indexes.clear()
+            else:
+                indexes.pop(client_id, None)
+            writeJSONAtomic(self.path, indexes)
+
+    def load(self):
+        # Read from disk on first use, then serve from memory
+        if self.indexes is None:
+            self.indexes = readJSON(self.path, {})
+        return self.indexes
+
+
+def foldNames(names):
+    """
+    Map lower-cased names to the original name, or None where two names differ
+    only in case
+    """
+    folded = {}
+    for name in names:
+        key = name.lower()
+        folded[key] = None if folded.get(key, name) != name else name
+    return folded
+
+
+def matchName(entries, folded, name):
+    """
+    Returns the key in entries for name, trying an exact match before a
+    case-insensitive one. Returns None if not found & raises AccountLookupError
+    if the name only matches entries that differ in case
+    """
+    if name in entries:
+        return name
+    key = name.lower()
+    if key not in folded:
+        return None
+    if folded[key] is None:
+        matches = sorted(entry for entry in entries if entry.lower() == key)
+        raise AccountLookupError(
+            f"{name} is ambiguous, it matches {', '.join(matches)}. "
+            "Use the exact name"
+        )
+    return folded[key]
+
+
+def lookupSmartAccount(index, domain):
+    """
+    Returns the indexed Smart Account entry for a domain
+    """
+    key = matchName(index["accounts"], index["folded"], domain)
+    if key is None:
+        raise AccountLookupError(f"Smart Account not found: {domain}")
+    return index["accounts"][key]
+
+
+def lookupVirtualAccounts(index, domain, names):
+    """
+    Resolve many Virtual Account names within a Smart Account in one pass
+
+    Returns (Smart Account ID, dict of VA name -> VA ID)
+    """
+    smart_account = lookupSmartAccount(index, domain)
+    virtual_accounts = smart_account["virtual_accounts"]
+    keys = {
+        name: matchName(virtual_accounts, smart_account["folded"], name)
+        for name in names
+    }
+    missing = [name for name, key in keys.items() if key is None]
+    if missing:
+        raise AccountLookupError(
+            f"Virtual Account(s) not found in {smart_account['domain']}: "
+            + ", ".join(missing)
+        )
+    return smart_account["account_id"], {
+        name: virtual_accounts[key] for name, key in keys.items()
+    }
@@ -0,0 +1,179 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# End-to-end throughput of the reservation, usage reporting & removal flows,
+# run against the local mock Smart Licensing API. Reports devices/sec, p50/p99
+# latency from submit to completed result, and API request counts.
+#
+#     python benchmarks/bench_end_to_end.py --devices 1 100 10000 --ok-poll 2
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from mockserver import MockConfig, MockServer
+from synthetic import TAGS, randomSerial, rumReport
+
+FLOWS = ("reserve", "report", "remove")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def runFlow(smartaccount, flow, devices, batch_size):
+    """
+    Run one flow for a list of devices with a fresh SmartAccount
+
+    Returns list of per-device latencies, in seconds
+    """
+    from inventory import batched
+    from pollscheduler import PollScheduler
+    from usagereport import chunkReports
+
+    sa = smartaccount.SmartAccount()
+    sa.getAuthToken()
+    sa.getAccountIDs()
+    jobs = []
+    if flow == "reserve":
+        for batch in batched(devices, batch_size):
+            job = sa.requestAuthCodes(batch)
+            job.context = (job.context, time.monotonic())
+            jobs.append(job)
+    elif flow == "report":
+        reports = [
+            {
+                "sudi": {"udi_pid": device.pid, "udi_serial_number": device.serial},
+                "usage": [
+                    json.loads(rumReport(device.pid, device.serial, TAGS[0], 1, 1))
+                ],
+            }
+            for device in devices
+        ]
+        chunks = list(chunkReports(reports, max_items=batch_size))
+        for job in sa.sendUsageReports(chunks)[0]:
+            job.context = (job.context, time.monotonic())
+            jobs.append(job)
+    else:
+        for device in devices:
+            device.remove_code = "RC-" + device.serial
+        for batch in batched(devices, batch_size):
+            job = sa.removeDeviceLicenses(batch)
+            job.context = (job.context, time.monotonic())
+            jobs.append(job)
+
+    latencies = []
+
+    def completed(job, response):
+        items, submitted = job.context
+        if response:
+            latencies.extend([time.monotonic() - submitted] * len(items))
+
+    PollScheduler(sa, max_concurrency=20).pollAll(jobs, callback=completed)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--flows", nargs="+", default=list(FLOWS), choices=FLOWS)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--ok-poll", type=float, default=2.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0.0,
+        help="Requests/sec the mock API accepts before answering 429",
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        args.latency,
+        args.ok_poll,
+        args.failure_rate,
+        args.throttle_rate,
+        args.rate_limit,
+    )
+    server = MockServer(config).start()
+    cache_dir = tempfile.mkdtemp()
+    # smartaccount reads its configuration when imported
+    os.environ.update(
+        {
+            "SMART_LICENSING_AUTH_URL": server.auth_url,
+            "SMART_LICENSING_BASE_URL": server.base_url,
+            "CLIENT_ID": "benchmark",
+            "CLIENT_SECRET": "benchmark",
+            "SMART_ACCOUNT": config.smart_account,
+            "VIRTUAL_ACCOUNT": config.virtual_accounts[0],
+            "LICENSE_TAG": TAGS[0],
+            "TOKEN_CACHE": os.path.join(cache_dir, "token_cache.json"),
+            "ACCOUNT_INDEX": os.path.join(cache_dir, "account_index.json"),
+            "JOB_JOURNAL": os.path.join(cache_dir, "jobs.db"),
+            "USAGE_INDEX": os.path.join(cache_dir, "usage_index.db"),
+            "RESERVATION_INDEX": os.path.join(cache_dir, "reservations.db"),
+        }
+    )
+    import smartaccount
+    from inventory import Device
+
+    smartaccount.console.quiet = True
+
+    results = []
+    for flow in args.flows:
+        for count in args.devices:
+            devices = [
+                Device("C8000V", randomSerial(), f"router{i}", {TAGS[0]: 1})
+                for i in range(count)
+            ]
+            before = Counter(server.state.counts)
+            start = time.monotonic()
+            latencies = runFlow(smartaccount, flow, devices, args.batch_size)
+            elapsed = time.monotonic() - start
+            requests = dict(Counter(server.state.counts) - before)
+            results.append(
+                {
+                    "flow": flow,
+                    "devices": count,
+                    "completed": len(latencies),
+                    "seconds": round(elapsed, 3),
+                    "devices_per_sec": round(len(latencies) / elapsed, 2),
+                    "p50": round(percentile(latencies, 50), 3),
+                    "p99": round(percentile(latencies, 99), 3),
+                    "requests": requests,
+                }
+            )
+            if not args.json:
+                result = results[-1]
+                print(
+                    f"{flow:>8} {count:>6} devices: {result['devices_per_sec']:>9.1f} dev/s  "
+                    f"p50 {result['p50']:.2f}s  p99 {result['p99']:.2f}s  "
+                    f"requests {sum(requests.values())} {requests}"
+                )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Micro-benchmark of selecting RUM usage items by entitlement tag: the previous
+# parse & re-serialize of every payload against passing the payload through
+# untouched & scanning for the tag.
+#
+#     python benchmarks/bench_payload_passthrough.py --items 20000
+
+import argparse
+import json
+import timeit
+
+from synthetic import TAGS, randomSerial, rumReport
+from usagereport import entitlementTag
+
+
+def reserialize(usage_item, license_tag):
+    # Previous approach: parse the payload, then dump it & strip all spaces
+    payload = json.loads(usage_item["payload"])
+    if payload["meta"]["entitlement_tag"] == license_tag:
+        escaped_payload = json.dumps(payload).replace('"', '"').replace(" ", "")
+        return {"payload": escaped_payload, "signature": usage_item["signature"]}
+
+
+def passthrough(usage_item, license_tag):
+    if entitlementTag(usage_item["payload"]) == license_tag:
+        return {"payload": usage_item["payload"], "signature": usage_item["signature"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RUM payload passthrough benchmark")
+    parser.add_argument("--items", type=int, default=20000, help="Usage items per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per method")
+    args = parser.parse_args()
+
+    serials = [randomSerial() for i in range(50)]
+    usage_items = [
+        json.loads(
+            rumReport("C8000V", serials[i % 50], TAGS[i % len(TAGS)], i, 1657549482 + i)
+        )
+        for i in range(args.items)
+    ]
+    # A payload with a space inside a string value, as some software versions write
+    usage_items[0]["payload"] = usage_items[0]["payload"].replace(
+        '"17.06.02"', '"17.06.02 SPA"'
+    )
+
+    for name, method in (("reserialize", reserialize), ("passthrough", passthrough)):
+        runs = timeit.repeat(
+            lambda: [method(item, TAGS[0]) for item in usage_items],
+            number=1,
+            repeat=args.repeat,
+        )
+        best = min(runs)
+        results = [method(item, TAGS[0]) for item in usage_items]
+        exact = sum(
+            1
+            for item, result in zip(usage_items, results)
+            if result and result["payload"] == item["payload"]
+        )
+        kept = sum(1 for result in results if result)
+        print(
+            f"{name:>12}: {best * 1e6 / args.items:8.2f} us/item  "
+            f"{args.items / best:10.0f} items/s  byte-exact {exact}/{kept}"
+        )
+
+
+if __name__ == "__main__":
+    main()
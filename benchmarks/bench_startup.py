@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Cold-start time of each script, measured as fresh interpreters running
+# "--help" (everything is imported before arguments are parsed). Also breaks
+# down where import time goes, like "python -X importtime", so a module that
+# starts importing something heavy again shows up straight away.
+#
+#     python benchmarks/bench_startup.py --runs 20 --top 8
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = {
+    "python": ["-c", "pass"],
+    "import smartaccount": ["-c", "import smartaccount"],
+    "01 - reserve license": [os.path.join(ROOT, "01 - reserve license.py"), "--help"],
+    "02 - report license usage": [
+        os.path.join(ROOT, "02 - report license usage.py"),
+        "--help",
+    ],
+    "03 - remove license": [os.path.join(ROOT, "03 - remove license.py"), "--help"],
+    "04 - reconcile fleet": [
+        os.path.join(ROOT, "04 - reconcile fleet.py"),
+        "--help",
+    ],
+}
+
+
+def coldStart(args, runs):
+    """
+    Returns list of wall-clock times in ms for runs fresh interpreters
+    """
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args], cwd=ROOT, capture_output=True, check=True
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def importBreakdown(args):
+    """
+    Returns dict of top-level module -> cumulative import time in ms, as
+    reported by -X importtime
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        # Nested imports are indented under the module that imported them
+        if name.startswith("  "):
+            continue
+        modules[name.strip()] = int(cumulative_us) / 1000
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Script start-up time benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--top", type=int, default=6, help="Slowest top-level imports to list"
+    )
+    parser.add_argument(
+        "--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS)
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for target in args.targets:
+        times = coldStart(TARGETS[target], args.runs)
+        modules = importBreakdown(TARGETS[target])
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)
+        results.append(
+            {
+                "target": target,
+                "median_ms": round(statistics.median(times), 1),
+                "min_ms": round(min(times), 1),
+                "import_ms": round(sum(modules.values()), 1),
+                "slowest_imports": {
+                    name: round(ms, 1) for name, ms in slowest[: args.top]
+                },
+            }
+        )
+        if not args.json:
+            result = results[-1]
+            print(
+                f"{target:>26}: median {result['median_ms']:>6.1f} ms  "
+                f"min {result['min_ms']:>6.1f} ms  imports {result['import_ms']:>6.1f} ms"
+            )
+            for name, ms in result["slowest_imports"].items():
+                print(f"{'':>28}{ms:>6.1f} ms  {name}")
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Peak memory & upload time of a multi-device usage report upload, comparing a
+# body built in memory with one streamed as it is encoded, each with & without
+# gzip. Uploads go to the local mock API, which can be slowed to a jump-host
+# link with --bandwidth. Each upload runs in a fresh interpreter, & the mock in
+# its own process, so peak RSS isn't shared.
+#
+#     python benchmarks/bench_upload_body.py --sizes 5 20 50 --bandwidth 2
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from mockserver import MockConfig
+from synthetic import TAGS, randomSerial, rumReport
+
+# (stream, compress) for each mode
+MODES = {
+    "memory": (False, False),
+    "memory+gzip": (False, True),
+    "stream": (True, False),
+    "stream+gzip": (True, True),
+}
+
+
+def buildReports(size_mb, devices=50):
+    """
+    Returns a "reports" list of roughly size_mb of usage, spread over devices
+    """
+    serials = [randomSerial() for i in range(devices)]
+    usage = {serial: [] for serial in serials}
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        serial = serials[i % devices]
+        item = json.loads(
+            rumReport("C8000V", serial, TAGS[0], 1646687408 + i, 1657549482 + i)
+        )
+        del item["header"]
+        usage[serial].append(item)
+        size += len(item["payload"]) + len(item["signature"]["value"]) + 150
+        i += 1
+    return [
+        {"sudi": {"udi_pid": "C8000V", "udi_serial_number": serial}, "usage": items}
+        for serial, items in usage.items()
+    ]
+
+
+def peakRSS():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def currentRSS():
+    # Resident pages are the second field of /proc/self/statm (Linux only)
+    with open("/proc/self/statm") as a:
+        return int(a.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def measure(mode, size_mb):
+    """
+    Upload one report set in this process & print results as JSON
+    """
+    import smartaccount
+    from metrics import metrics
+
+    smartaccount.console.quiet = True
+    sa = smartaccount.SmartAccount()
+    sa.getAuthToken()
+    sa.getAccountIDs()
+    sa.stream_uploads, sa.compress_uploads = MODES[mode]
+    reports = buildReports(size_mb)
+    sudi = reports[0]["sudi"]
+    # Building the reports leaves garbage behind, which would hide the upload's
+    # own peak, so compare against what's in use just before uploading
+    gc.collect()
+    before = currentRSS()
+    start = time.perf_counter()
+    poll_id = sa.sendUsageReport(reports, sudi["udi_pid"], sudi["udi_serial_number"])
+    elapsed = time.perf_counter() - start
+    sent = sum(
+        value
+        for (name, labels), value in metrics.counters.items()
+        if name == "http_bytes_sent" and "reportusage" in dict(labels)["endpoint"]
+    )
+    print(
+        json.dumps(
+            {
+                "accepted": bool(poll_id),
+                "sent_mb": sent / 1024 / 1024,
+                "seconds": elapsed,
+                "peak_rss_mb": peakRSS(),
+                "extra_rss_mb": max(peakRSS() - before, 0),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Usage report upload benchmark")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[5, 20, 50], help="Report sizes in MB"
+    )
+    parser.add_argument(
+        "--modes", nargs="+", default=list(MODES), help="Body encodings to compare"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0.0,
+        help="Upload link speed in MB/s. 0 means unlimited (default: 0)",
+    )
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure[0], int(args.measure[1]))
+        return
+
+    # Peak RSS carries over from parent to child process, so the mock, which
+    # keeps every report it receives, runs on its own
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "mockserver.py"),
+            "--port=0",
+            "--ok-poll=0",
+            f"--bandwidth={args.bandwidth * 1024 * 1024}",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    auth_url = server.stdout.readline().split()[-1]
+    base_url = server.stdout.readline().split()[-1]
+    config = MockConfig()
+    cache_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        SMART_LICENSING_AUTH_URL=auth_url,
+        SMART_LICENSING_BASE_URL=base_url,
+        CLIENT_ID="benchmark",
+        CLIENT_SECRET="benchmark",
+        SMART_ACCOUNT=config.smart_account,
+        VIRTUAL_ACCOUNT=config.virtual_accounts[0],
+        LICENSE_TAG=TAGS[0],
+        TOKEN_CACHE=os.path.join(cache_dir, "token_cache.json"),
+        ACCOUNT_INDEX=os.path.join(cache_dir, "account_index.json"),
+        JOB_JOURNAL=os.path.join(cache_dir, "jobs.db"),
+        USAGE_INDEX=os.path.join(cache_dir, "usage_index.db"),
+        RESERVATION_INDEX=os.path.join(cache_dir, "reservations.db"),
+    )
+
+    print(
+        f"{'size':>6} {'mode':>12} {'sent MB':>8} {'seconds':>8} "
+        f"{'peak MB':>8} {'extra MB':>9}"
+    )
+    try:
+        for size in args.sizes:
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", mode, str(size)],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                result = json.loads(output)
+                print(
+                    f"{size:>4}MB {mode:>12} {result['sent_mb']:>8.2f} "
+                    f"{result['seconds']:>8.2f} {result['peak_rss_mb']:>8.1f} "
+                    f"{result['extra_rss_mb']:>9.1f}"
+                    + ("" if result["accepted"] else "  (rejected)")
+                )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
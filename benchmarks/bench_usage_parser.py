@@ -0,0 +1,107 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Compare time & peak memory of the streaming, pre-flight checked usage reader
+# used by the upload scripts against a full ElementTree parse, for synthetic usage files of increasing size.
+# Each measurement runs in a fresh interpreter so peak RSS isn't shared.
+#
+#     python benchmarks/bench_usage_parser.py --sizes 1 10 100 1000
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import TAGS, writeUsageFile
+
+
+def parseFull(usage_file):
+    # Previous approach: load the whole document tree before reading reports
+    import xml.etree.ElementTree as ET
+
+    count = 0
+    with open(usage_file, "r") as a:
+        tree = ET.parse(a).getroot()
+    for item in tree.findall("./RUMReport"):
+        usage_item = json.loads(item.text)
+        payload = json.loads(usage_item["payload"])
+        if payload["meta"]["entitlement_tag"] == TAGS[0]:
+            count += 1
+    return count
+
+
+def parseStreaming(usage_file):
+    # The path the upload scripts take, checking each item as it's read
+    from preflight import PreflightResult, iterCheckedUsage
+
+    items = iterCheckedUsage([usage_file], PreflightResult(), TAGS[0], workers=1)
+    return sum(1 for item in items)
+
+
+def measure(method, usage_file):
+    """
+    Run one parser in this process & print results as JSON
+    """
+    start = time.perf_counter()
+    count = {"full": parseFull, "streaming": parseStreaming}[method](usage_file)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"items": count, "seconds": elapsed, "peak_rss_mb": peak_mb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Usage report parser benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100, 1000],
+        help="File sizes in MB",
+    )
+    parser.add_argument(
+        "--methods", nargs="+", default=["full", "streaming"], help="Parsers to compare"
+    )
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    print(f"{'size':>8} {'method':>10} {'items':>9} {'seconds':>9} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            usage_file = os.path.join(directory, f"usage_{size}mb.txt")
+            writeUsageFile(usage_file, size * 1024 * 1024, devices=10)
+            for method in args.methods:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", method, usage_file],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                result = json.loads(output)
+                print(
+                    f"{size:>6}MB {method:>10} {result['items']:>9} "
+                    f"{result['seconds']:>9.2f} {result['peak_rss_mb']:>9.1f}"
+                )
+            os.remove(usage_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Local stand-in for Cisco SSO & the Smart Licensing APIs used by these scripts.
+# Responses follow the JSON shapes in the bundled Postman collection.
+#
+#     python benchmarks/mockserver.py --port 8443 --latency 0.05 --ok-poll 5
+#
+# Then point the scripts at it with:
+#     SMART_LICENSING_AUTH_URL=http://127.0.0.1:8443/as/token.oauth2
+#     SMART_LICENSING_BASE_URL=http://127.0.0.1:8443/services/api/smart-accounts-and-licensing/
+
+import argparse
+import base64
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/services/api/smart-accounts-and-licensing/"
+TOKEN_PATH = "/as/token.oauth2"
+
+
+class MockConfig:
+    """
+    Behaviour of the mock API
+
+    latency - seconds added to every response
+    ok_poll - seconds a submitted task reports OK_POLL before it is COMPLETE
+    failure_rate - fraction of requests answered with a 500
+    throttle_rate - fraction of requests answered with a 429 & Retry-After
+    rate_limit - requests per second the API accepts before answering 429, like
+    a real rate limit. 0 means unlimited
+    bandwidth - bytes per second request bodies are received at, like a slow
+    link. 0 means unlimited
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        ok_poll=2.0,
+        failure_rate=0.0,
+        throttle_rate=0.0,
+        rate_limit=0.0,
+        bandwidth=0.0,
+        retry_after=1,
+        smart_account="testaccount.local",
+        virtual_accounts=("Lab-01", "Lab-02"),
+    ):
+        self.latency = latency
+        self.ok_poll = ok_poll
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.bandwidth = bandwidth
+        self.retry_after = retry_after
+        self.smart_account = smart_account
+        self.virtual_accounts = virtual_accounts
+
+
+class MockState:
+    """
+    Submitted tasks & request counters, shared by all handler threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = {}
+        # Signatures of every usage item reported so far
+        self.reported = set()
+        self.counts = Counter()
+        self.bytes_received = 0
+        self.poll_ids = itertools.count(773126444402795033)
+        self.tokens = None
+        self.refilled = time.monotonic()
+
+    def addTask(self, action, items):
+        with self.lock:
+            poll_id = next(self.poll_ids)
+            self.tasks[poll_id] = {
+                "action": action,
+                "items": items,
+                "submitted": time.monotonic(),
+            }
+        return poll_id
+
+    def addUsage(self, reports):
+        """
+        Record reported usage items. Returns False without recording anything if
+        any item was already reported, as Smart Licensing rejects duplicates
+        """
+        signatures = [
+            json.dumps(usage_item["signature"], sort_keys=True)
+            for report in reports
+            for usage_item in report["usage"]
+        ]
+        with self.lock:
+            if self.reported.intersection(signatures):
+                return False
+            self.reported.update(signatures)
+        return True
+
+    def admit(self, rate_limit):
+        """
+        Token bucket holding one second of requests. Returns False if the
+        request is over the rate limit
+        """
+        if not rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            if self.tokens is None:
+                self.tokens = rate_limit
+            self.tokens = min(
+                rate_limit, self.tokens + (now - self.refilled) * rate_limit
+            )
+            self.refilled = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        return True
+
+    def count(self, name, body_bytes=0):
+        with self.lock:
+            self.counts[name] += 1
+            self.bytes_received += body_bytes
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers & body are written separately, which stalls on delayed ACKs otherwise
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        config = self.server.config
+        state = self.server.state
+        body = self.readBody()
+        path = self.path.split("?")[0]
+        name = path.rsplit("/", 1)[-1]
+        state.count(name, len(body))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        if config.latency:
+            time.sleep(config.latency)
+        roll = random.random()
+        if roll < config.throttle_rate or not state.admit(config.rate_limit):
+            state.count("throttled")
+            return self.reply(429, {"message": "Too Many Requests"}, config.retry_after)
+        if roll < config.throttle_rate + config.failure_rate:
+            state.count("failed")
+            return self.reply(500, {"message": "Internal Server Error"})
+        if not self.authorized(path):
+            return self.reply(401, {"message": "Unauthorized"})
+
+        if path == TOKEN_PATH:
+            return self.reply(
+                200,
+                {
+                    "access_token": uuid.uuid4().hex,
+                    "token_type": "Bearer",
+                    "expires_in": 3599,
+                },
+            )
+        if path == API_PREFIX + "v2/accounts/search":
+            return self.reply(200, self.accounts())
+        data = json.loads(body)["data"] if body else {}
+        if path == API_PREFIX + "v2/devices/authrequest":
+            poll_id = state.addTask("authorizations", data["licenses"])
+            return self.reply(200, self.submitted(data, poll_id, "authorizations"))
+        if path == API_PREFIX + "v2/devices/reportusage":
+            if not state.addUsage(data["reports"]):
+                state.count("duplicate")
+                return self.reply(200, self.rejected(data, "Duplicate usage report"))
+            poll_id = state.addTask("acknowledgements", data["reports"])
+            return self.reply(200, self.submitted(data, poll_id, "acknowledgements"))
+        if path == API_PREFIX + "v2/accounts/poll":
+            return self.reply(200, self.poll(data))
+        return self.reply(404, {"message": "Not Found"})
+
+    def readBody(self):
+        """
+        Read the request body as sent, whether it has a Content-Length or uses
+        chunked transfer encoding
+        """
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                chunks.append(self.read(size))
+                # Every chunk, including the last empty one, ends with CRLF
+                self.rfile.readline()
+                if not size:
+                    break
+            return b"".join(chunks)
+        return self.read(int(self.headers.get("Content-Length") or 0))
+
+    def read(self, size, block_size=64 * 1024):
+        """
+        Read size bytes of the body, a block at a time at the configured bandwidth
+        """
+        bandwidth = self.server.config.bandwidth
+        if not bandwidth:
+            return self.rfile.read(size)
+        blocks = []
+        while size > 0:
+            block = self.rfile.read(min(block_size, size))
+            blocks.append(block)
+            size -= len(block)
+            time.sleep(len(block) / bandwidth)
+        return b"".join(blocks)
+
+    def authorized(self, path):
+        if path == TOKEN_PATH:
+            return True
+        return self.headers.get("Authorization", "").startswith("Bearer ")
+
+    def accounts(self):
+        config = self.server.config
+        return {
+            "message_code": "",
+            "accounts": [
+                {
+                    "account_id": "123456",
+                    "domain": config.smart_account,
+                    "name": config.smart_account,
+                    "virtual_accounts": [
+                        {
+                            "default": False,
+                            "name": name,
+                            "virtual_account_id": str(200000 + i),
+                        }
+                        for i, name in enumerate(config.virtual_accounts)
+                    ],
+                }
+            ],
+            "message": "",
+            "status": "COMPLETE",
+        }
+
+    def submitted(self, data, poll_id, action):
+        return {
+            "status": "OK_POLL",
+            "message_code": None,
+            "message": None,
+            "timestamp": int(time.time() * 1000),
+            "nonce": data.get("nonce"),
+            "type": None,
+            "poll_id": poll_id,
+            "poll_interval": 300,
+            "action": action,
+        }
+
+    def rejected(self, data, message):
+        return {
+            "status": "FAILED",
+            "message_code": "DUPLICATE_REPORT",
+            "message": message,
+            "timestamp": int(time.time() * 1000),
+            "nonce": data.get("nonce"),
+        }
+
+    def poll(self, data):
+        state = self.server.state
+        task = state.tasks.get(int(data["poll_id"]))
+        response = {
+            "status": "OK_POLL",
+            "message_code": "",
+            "message": "",
+            "timestamp": int(time.time() * 1000),
+            "nonce": data.get("nonce"),
+            "type": data.get("action"),
+        }
+        if not task:
+            response["message"] = "Poll ID not found"
+            response["message_code"] = "POLL_ID_NOT_FOUND"
+            return response
+        if time.monotonic() - task["submitted"] < self.server.config.ok_poll:
+            return response
+        response["status"] = "COMPLETE"
+        response["correlation_id"] = str(uuid.uuid4())
+        if task["action"] == "acknowledgements":
+            response["data"] = {
+                "acknowledgements": [self.ack(report) for report in task["items"]]
+            }
+        else:
+            response["data"] = {
+                "authorizations": [self.authorization(item) for item in task["items"]]
+            }
+        return response
+
+    def authorization(self, license_request):
+        sudi = license_request["sudi"]
+        removal = "remove_code" in license_request
+        smart_license = None
+        if not removal:
+            smart_license = base64.b64encode(
+                f"<smartLicense><udi>PID:{sudi['udi_pid']},SN:{sudi['udi_serial_number']}</udi>"
+                f"<keys>{json.dumps(license_request['keys'])}</keys></smartLicense>".encode()
+            ).decode()
+        return {
+            "product_instance_identifier": str(uuid.uuid4()),
+            "sudi": sudi,
+            "smart_license": smart_license,
+            "auth_status": [],
+            "error_code": None,
+            "status": "SUCCESS",
+            "status_message": None,
+            "correlation_id": uuid.uuid4().hex,
+        }
+
+    def ack(self, report):
+        sudi = report["sudi"]
+        return {
+            "sudi": sudi,
+            "software_tag_identifier": sudi["udi_pid"],
+            "smart_license": base64.b64encode(
+                f"<smartLicense><ack>{len(report['usage'])}</ack></smartLicense>".encode()
+            ).decode(),
+        }
+
+    def reply(self, status, body, retry_after=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockHandler)
+        self.config = config or MockConfig()
+        self.state = MockState()
+
+    @property
+    def auth_url(self):
+        return f"http://{self.server_address[0]}:{self.server_port}{TOKEN_PATH}"
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_port}{API_PREFIX}"
+
+    def start(self):
+        """
+        Serve requests on a background thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Smart Licensing API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--ok-poll", type=float, default=2.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=0.0)
+    args = parser.parse_args()
+    config = MockConfig(
+        args.latency,
+        args.ok_poll,
+        args.failure_rate,
+        args.throttle_rate,
+        args.rate_limit,
+        args.bandwidth,
+    )
+    server = MockServer(config, args.host, args.port)
+    print(f"Auth URL: {server.auth_url}")
+    print(f"Base URL: {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
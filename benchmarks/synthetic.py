@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import os
+import random
+import string
+import sys
+
+# Benchmarks run from the repo root or this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TAGS = [
+    "regid.2019-03.com.cisco.DNA_HSEC,1.0_509c41ab-05a8-431f-95fe-ec28086e8844",
+    "regid.2018-12.com.cisco.DNA_P_50M_A,1.0_100fb8b2-f5cc-459c-9253-ac77b827fd71",
+    "regid.2019-10.com.cisco.C8000V_T2_A,1.0_e361c3dc-27c2-4084-b4a4-cae639cff335",
+]
+ASSET = "regid.2019-10.com.cisco.C8000V,1.0_e361c3dc-27c2-4084-b4a4-cae639cff335"
+
+
+def randomSerial():
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=11))
+
+
+def rumPayload(pid, serial, tag, report_id, log_time):
+    """
+    Returns a RUM payload string, formatted the way devices write them
+    """
+    sudi = {"udi_pid": pid, "udi_serial_number": serial}
+    payload = {
+        "asset_identification": {
+            "asset": {"name": ASSET},
+            "instance": {"sudi": sudi},
+            "signature": {"signing_type": "builtin", "key": ASSET, "value": serial},
+        },
+        "meta": {
+            "entitlement_tag": tag,
+            "report_id": report_id,
+            "software_version": "17.06.02",
+            "ha_udi": [{"role": "Active", "sudi": sudi}],
+        },
+        "measurements": [
+            {
+                "log_time": log_time,
+                "metric_name": "ENTITLEMENT",
+                "start_time": log_time - 1336,
+                "end_time": log_time,
+                "sample_interval": 1336,
+                "num_samples": 2,
+                "meta": {"termination_reason": "CurrentUsageRequested"},
+                "value": {"type": "COUNT", "value": "1"},
+            }
+        ],
+    }
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def rumReport(pid, serial, tag, report_id, log_time):
+    """
+    Returns the JSON text of a single RUMReport element
+    """
+    return json.dumps(
+        {
+            "payload": rumPayload(pid, serial, tag, report_id, log_time),
+            "header": {"type": "rum"},
+            "signature": {
+                "sudi": {"udi_pid": pid, "udi_serial_number": serial},
+                "signing_type": "builtin",
+                "key": "".join(random.choices(string.hexdigits, k=32)),
+                "value": "".join(random.choices(string.ascii_letters, k=344)),
+            },
+        },
+        separators=(",", ":"),
+    )
+
+
+def writeUsageFile(path, size_bytes, devices=1, pid="C8000V", seed=1):
+    """
+    Write a synthetic saved usage file of roughly size_bytes
+
+    Reports rotate across the given number of devices & all sample entitlement tags
+    """
+    random.seed(seed)
+    serials = [randomSerial() for i in range(devices)]
+    written = 0
+    report_id = 1646687408
+    log_time = 1657549482
+    with open(path, "w") as a:
+        header = '<?xml version="1.0" encoding="UTF-8"?><smartLicense>'
+        a.write(header)
+        written += len(header)
+        i = 0
+        while written < size_bytes:
+            serial = serials[i % devices]
+            tag = TAGS[(i // devices) % len(TAGS)]
+            line = f"<RUMReport>{rumReport(pid, serial, tag, report_id + i, log_time + i)}</RUMReport>\n"
+            a.write(line)
+            written += len(line)
+            i += 1
+        a.write("</smartLicense>\n")
+    return serials
@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+from accountindex import DEFAULT_TTL
+from inventory import parseEntitlements
+from pipeline import (
+    DECODE_WORKERS,
+    POLL_WORKERS,
+    QUEUE_SIZE,
+    SUBMIT_WORKERS,
+    WRITE_WORKERS,
+)
+from ratelimit import AUTH_RATE, POLL_RATE, SUBMIT_RATE
+from transport import CONNECT_TIMEOUT, POOL_SIZE, READ_TIMEOUT, RETRIES
+
+# Settings are read from .env once, the first time this module is imported,
+# & shared by smartaccount & all the scripts
+load_dotenv()
+
+# Name of the tenant configured by the settings below, as opposed to tenants
+# read from a tenant config file (see tenants.py)
+DEFAULT_TENANT = "default"
+# API endpoints can be overridden, such as to test against a local mock server
+SMART_LICENSING_AUTH_URL = os.getenv("SMART_LICENSING_AUTH_URL")
+SMART_LICENSING_BASE_URL = os.getenv("SMART_LICENSING_BASE_URL")
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+SMART_ACCOUNT = os.getenv("SMART_ACCOUNT")
+VIRTUAL_ACCOUNT = os.getenv("VIRTUAL_ACCOUNT")
+LICENSE_TAG = os.getenv("LICENSE_TAG")
+# LICENSE_TAG may list several entitlements, see inventory.parseEntitlements
+LICENSE_TAGS = parseEntitlements(LICENSE_TAG)
+DEVICE_SERIAL = os.getenv("DEVICE_SERIAL")
+DEVICE_PID = os.getenv("DEVICE_PID")
+DEVICE_HOSTNAME = os.getenv("DEVICE_HOSTNAME")
+TOKEN_CACHE = os.getenv("TOKEN_CACHE")
+ACCOUNT_INDEX = os.getenv("ACCOUNT_INDEX")
+ACCOUNT_INDEX_TTL = int(os.getenv("ACCOUNT_INDEX_TTL") or DEFAULT_TTL)
+JOB_JOURNAL = os.getenv("JOB_JOURNAL")
+USAGE_INDEX = os.getenv("USAGE_INDEX")
+RESERVATION_INDEX = os.getenv("RESERVATION_INDEX")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE") or POOL_SIZE)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES") or RETRIES)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT") or CONNECT_TIMEOUT)
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT") or READ_TIMEOUT)
+# Usage reports can be streamed as they are encoded & gzipped, if the API & any
+# proxy in between accept chunked & compressed request bodies
+UPLOAD_STREAMING = os.getenv("UPLOAD_STREAMING", "").lower() in ("1", "true", "yes")
+UPLOAD_GZIP = os.getenv("UPLOAD_GZIP", "").lower() in ("1", "true", "yes")
+# Requests per second allowed to each kind of API call. 0 turns the limit off
+API_RATE_AUTH = float(os.getenv("API_RATE_AUTH") or AUTH_RATE)
+API_RATE_SUBMIT = float(os.getenv("API_RATE_SUBMIT") or SUBMIT_RATE)
+API_RATE_POLL = float(os.getenv("API_RATE_POLL") or POLL_RATE)
+# Upper bound for the adaptive number of requests in flight to each kind of API call
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY") or HTTP_POOL_SIZE)
+# Worker threads for each stage of the batch reserve, report & remove flows, &
+# how many items can wait between two stages
+PIPELINE_SUBMIT_WORKERS = int(os.getenv("PIPELINE_SUBMIT_WORKERS") or SUBMIT_WORKERS)
+PIPELINE_POLL_WORKERS = int(os.getenv("PIPELINE_POLL_WORKERS") or POLL_WORKERS)
+PIPELINE_DECODE_WORKERS = int(os.getenv("PIPELINE_DECODE_WORKERS") or DECODE_WORKERS)
+PIPELINE_WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS") or WRITE_WORKERS)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE") or QUEUE_SIZE)
+# Worker processes used to check usage files before upload. 0 means one per CPU
+PREFLIGHT_WORKERS = int(os.getenv("PREFLIGHT_WORKERS") or 0)
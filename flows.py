@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+
+from config import (
+    PIPELINE_DECODE_WORKERS,
+    PIPELINE_POLL_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_SUBMIT_WORKERS,
+    PIPELINE_WRITE_WORKERS,
+    PREFLIGHT_WORKERS,
+)
+from output import console
+from pipeline import Pipeline
+from pollscheduler import PollJob, PollScheduler
+from preflight import PreflightResult, iterCheckedUsage, writeErrorReport
+from smartaccount import decodeSmartLicense
+from usagereport import groupTaggedUsage, reportTags
+
+
+def runJobs(sa, items, submit, decode, write, fan_out=False):
+    """
+    Submit, poll, decode & save a stream of requests in separate pipeline stages
+
+    Results are written out as soon as each request completes while others
+    are still being polled, & submissions wait while the poll queue is full.
+    Resumed PollJobs in items go straight to polling. submit(item) returns a
+    PollJob, or a list of them if fan_out is set. decode((job, response))
+    returns a list of items to write. Returns dict of stage name -> number of
+    items processed
+    """
+    scheduler = PollScheduler(sa)
+
+    def start(item):
+        if isinstance(item, PollJob):
+            return [item] if fan_out else item
+        return submit(item)
+
+    pipeline = Pipeline(PIPELINE_QUEUE_SIZE)
+    pipeline.add("submit", start, PIPELINE_SUBMIT_WORKERS, fan_out=fan_out)
+    pipeline.add("poll", scheduler.pollOne, PIPELINE_POLL_WORKERS)
+    pipeline.add("decode", decode, PIPELINE_DECODE_WORKERS, fan_out=True)
+    pipeline.add("write", write, PIPELINE_WRITE_WORKERS)
+    return pipeline.run(items)
+
+
+def decodeAcks(job, poll_data):
+    """
+    Decode each device's ACK from an acknowledgements poll response
+
+    Returns (list of (UDI, ACK data, entitlement tags), list of (UDI, error
+    message) for ACKs that couldn't be decoded)
+    """
+    # Jobs resumed from the journal only know their devices, not what was in
+    # the reports, so have no entitlement tags
+    tags = {}
+    if job.context and isinstance(job.context[0], dict):
+        tags = reportTags(job.context)
+    acks = []
+    errors = []
+    for ack in poll_data["data"]["acknowledgements"]:
+        sudi = ack["sudi"]
+        udi = (sudi["udi_pid"], sudi["udi_serial_number"])
+        try:
+            acks.append((udi, decodeSmartLicense(ack["smart_license"]), tags.get(udi)))
+        except ValueError as e:
+            errors.append((udi, str(e)))
+    return acks, errors
+
+
+def checkUsage(
+    usage_files, license_tags, default_udi, report_file, workers=PREFLIGHT_WORKERS
+):
+    """
+    Check every usage item in usage_files before anything is uploaded
+
+    Bad items are listed in a CSV report at report_file once every file has
+    been read, so they can be fixed without waiting on Smart Licensing to
+    reject them. Returns a generator of (license tag, usage item) for the items
+    that passed
+    """
+    result = PreflightResult()
+    yield from iterCheckedUsage(usage_files, result, license_tags, default_udi, workers)
+    if result.errors:
+        writeErrorReport(report_file, result.errors)
+        console.print(
+            f"[yellow]{len(result.errors)} of {result.checked} usage items failed pre-flight checks & won't be uploaded. See: [bold]{report_file}"
+        )
+        for error in result.errors[:3]:
+            console.print(
+                f"[yellow]  {os.path.basename(error['file'])} item {error['item']}: {error['error']}"
+            )
+
+
+def newUsage(sa, items, default_udi, resumed=()):
+    """
+    Group a stream of checked usage items by device, keeping only usage that
+    still needs uploading
+
+    Items at or below each device's last acknowledged report, or uploaded by
+    an earlier run, are dropped. So are devices with an upload in resumed,
+    which are picked up when it's polled again rather than uploaded twice.
+    Returns (dict of UDI -> usage items, number of items already uploaded)
+    """
+    devices = groupTaggedUsage(
+        items, default_udi=default_udi, watermarks=sa.usage_index.watermarks()
+    )
+    for job in resumed:
+        for device in job.context:
+            devices.pop(device.udi, None)
+    # Usage files overlap between collections, so drop items uploaded by an
+    # earlier run before building the reports
+    return sa.usage_index.filterNew(devices)
@@ -0,0 +1,168 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+
+# Inventory files may use either short or descriptive column names
+FIELD_ALIASES = {
+    "pid": "pid",
+    "udi_pid": "pid",
+    "serial": "serial",
+    "udi_serial_number": "serial",
+    "hostname": "hostname",
+    "entitlement": "entitlement",
+    "entitlements": "entitlement",
+    "license_tag": "entitlement",
+    "count": "count",
+    "remove_code": "remove_code",
+    "return_code": "remove_code",
+}
+
+
+@dataclass
+class Device:
+    """
+    A single device entry from an inventory file
+
+    entitlements maps each license tag to reserve to its count. remove_code is
+    only needed to return a device's licenses
+    """
+
+    pid: str
+    serial: str
+    hostname: str = ""
+    entitlements: dict = field(default_factory=dict)
+    remove_code: str = ""
+
+    @property
+    def udi(self):
+        """
+        Returns (PID, serial) tuple, which uniquely identifies a device
+        """
+        return (self.pid, self.serial)
+
+
+def parseEntitlements(value, default_count=1):
+    """
+    Parse a list of license tags with optional counts
+
+    Tags are separated by ";" & may be followed by "=<count>", for example:
+    "regid.2019-03.com.cisco.DNA_HSEC,1.0_509c...;regid.2018-12.com.cisco.DNA_P_50M_A,1.0_100f...=2"
+
+    Returns dict of license tag -> count
+    """
+    entitlements = {}
+    for entry in (value or "").split(";"):
+        tag, _, count = entry.partition("=")
+        if tag.strip():
+            entitlements[tag.strip()] = int(count or default_count)
+    return entitlements
+
+
+def readRecords(path):
+    """
+    Read records from a CSV or JSON device file
+
+    Returns list of dicts with normalized field names. Each record is checked
+    for a PID & serial
+    """
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path, "r") as a:
+            records = json.load(a)
+        # Accept either a bare list or {"devices": [...]}
+        if isinstance(records, dict):
+            records = records["devices"]
+    else:
+        with open(path, "r", newline="") as a:
+            records = list(csv.DictReader(a))
+
+    normalized = []
+    for line, record in enumerate(records, start=1):
+        fields = {}
+        for key, value in record.items():
+            name = FIELD_ALIASES.get(str(key).strip().lower())
+            if name and value not in (None, ""):
+                fields[name] = value if isinstance(value, dict) else str(value).strip()
+        if "pid" not in fields or "serial" not in fields:
+            raise ValueError(f"{path}: record {line} is missing a PID or serial")
+        normalized.append(fields)
+    return normalized
+
+
+def loadInventory(path, default_entitlements=None):
+    """
+    Read a CSV or JSON device inventory file
+
+    Each record needs a PID & serial. Hostname, entitlement & count are optional,
+    entitlement falls back to default_entitlements & count to 1. Records for the
+    same device are merged, so a device can reserve several entitlements.
+
+    Returns list of Device objects
+    """
+    devices = {}
+    for line, fields in enumerate(readRecords(path), start=1):
+        # JSON inventories may give entitlements as a {tag: count} object
+        entitlement = fields.get("entitlement")
+        if isinstance(entitlement, dict):
+            entitlements = {tag: int(count) for tag, count in entitlement.items()}
+        elif entitlement:
+            entitlements = parseEntitlements(entitlement, int(fields.get("count", 1)))
+        else:
+            entitlements = {
+                tag: int(fields.get("count", count))
+                for tag, count in (default_entitlements or {}).items()
+            }
+        if not entitlements:
+            raise ValueError(f"{path}: record {line} has no entitlement")
+        device = devices.setdefault(
+            (fields["pid"], fields["serial"]),
+            Device(fields["pid"], fields["serial"], fields.get("hostname", "")),
+        )
+        device.entitlements.update(entitlements)
+    return list(devices.values())
+
+
+def loadRemovals(path):
+    """
+    Read a CSV or JSON file of license removal codes
+
+    Each record needs a PID, serial & remove_code. Hostname is optional.
+    Returns list of Device objects
+    """
+    devices = []
+    for line, fields in enumerate(readRecords(path), start=1):
+        if not fields.get("remove_code"):
+            raise ValueError(f"{path}: record {line} is missing a remove_code")
+        devices.append(
+            Device(
+                fields["pid"],
+                fields["serial"],
+                fields.get("hostname", ""),
+                remove_code=fields["remove_code"],
+            )
+        )
+    return devices
+
+
+def batched(items, batch_size):
+    """
+    Split a list into consecutive chunks of at most batch_size items
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1")
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
@@ -0,0 +1,135 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import os
+import time
+
+from config import DEFAULT_TENANT
+from inventory import Device
+from pollscheduler import PollJob
+from storage import SQLiteStore
+
+DEFAULT_JOURNAL_FILE = os.path.join("~", ".smartlicensing", "jobs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    poll_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    action TEXT NOT NULL,
+    devices TEXT NOT NULL,
+    headers TEXT,
+    nonce TEXT,
+    submitted_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    completed_at REAL,
+    tenant TEXT NOT NULL DEFAULT 'default'
+);
+CREATE INDEX IF NOT EXISTS jobs_outstanding ON jobs (status, kind);
+"""
+
+# Journals created before multi-tenant runs have no tenant column. Their jobs
+# all belong to the default tenant
+ADD_TENANT_COLUMN = "ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'"
+
+# Job statuses
+SUBMITTED = "SUBMITTED"
+COMPLETE = "COMPLETE"
+FAILED = "FAILED"
+
+
+class JobJournal(SQLiteStore):
+    """
+    Durable record of every task submitted to Smart Licensing
+
+    Each submitted request is written with its Poll ID before we start polling,
+    so if a run is interrupted the next run can resume polling the outstanding
+    tasks instead of submitting them again.
+
+    kind is the flow that submitted the job: "reserve", "report" or "remove".
+    Jobs are also tagged with the tenant that submitted them, since they can
+    only be polled with that tenant's credentials
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or DEFAULT_JOURNAL_FILE)
+
+    def migrate(self, connection):
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+        if "tenant" not in columns:
+            connection.execute(ADD_TENANT_COLUMN)
+
+    def record(self, kind, job, devices, nonce=None, tenant=DEFAULT_TENANT):
+        """
+        Save a newly submitted job, along with the devices it covers
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO jobs (poll_id, kind, action, devices, headers,"
+                " nonce, submitted_at, status, tenant)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(job.poll_id),
+                    kind,
+                    job.action,
+                    json.dumps([[d.pid, d.serial, d.hostname] for d in devices]),
+                    json.dumps(job.headers),
+                    nonce,
+                    time.time(),
+                    SUBMITTED,
+                    tenant,
+                ),
+            )
+
+    def finish(self, poll_id, response, error=None):
+        """
+        Save the outcome of a polled job. A missing response marks it failed
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, completed_at = ?"
+                " WHERE poll_id = ?",
+                (
+                    COMPLETE if response else FAILED,
+                    json.dumps(response) if response else None,
+                    error,
+                    time.time(),
+                    str(poll_id),
+                ),
+            )
+
+    def outstanding(self, kind, udi=None, tenant=DEFAULT_TENANT):
+        """
+        Returns tenant's PollJobs that were submitted but never finished
+
+        Each job's context is the list of Devices it covers. If udi is given,
+        only jobs covering that device are returned
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT poll_id, action, devices, headers FROM jobs"
+                " WHERE status = ? AND kind = ? AND tenant = ? ORDER BY submitted_at",
+                (SUBMITTED, kind, tenant),
+            ).fetchall()
+        jobs = []
+        for poll_id, action, devices, headers in rows:
+            devices = [Device(*device) for device in json.loads(devices)]
+            if udi and udi not in (device.udi for device in devices):
+                continue
+            jobs.append(PollJob(int(poll_id), action, json.loads(headers), devices))
+        return jobs
@@ -0,0 +1,211 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "smartlicensing"
+
+# Histogram buckets for latencies in seconds & for poll attempt counts
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class Metrics:
+    """
+    Process-wide counters, latency histograms & per-job records
+
+    Recording is cheap & thread safe. Results are written out at the end of a run
+    as JSON lines & in Prometheus text format.
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.jobs = []
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add value to a counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Record a value in a histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": buckets, "counts": [0] * len(buckets)}
+                histogram.update({"count": 0, "sum": 0.0})
+                self.histograms[key] = histogram
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Record how long the with block takes in a latency histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """
+        Decorator recording each call's duration in a latency histogram
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def recordJob(self, poll_id, action, attempts, seconds, status):
+        """
+        Record the outcome of a polled Smart Licensing task
+        """
+        self.observe("poll_attempts", attempts, ATTEMPT_BUCKETS, action=action)
+        self.observe("poll_job_seconds", seconds, action=action)
+        with self.lock:
+            self.jobs.append(
+                {
+                    "poll_id": poll_id,
+                    "action": action,
+                    "attempts": attempts,
+                    "seconds": round(seconds, 3),
+                    "status": status,
+                }
+            )
+
+    def toJSONLines(self):
+        """
+        Returns list of JSON strings, one per counter, histogram & polled job
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(
+                    {
+                        "type": "counter",
+                        "name": name,
+                        "labels": dict(labels),
+                        "value": value,
+                    }
+                )
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                lines.append(
+                    {
+                        "type": "histogram",
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": histogram["count"],
+                        "sum": round(histogram["sum"], 6),
+                        "buckets": dict(
+                            zip(map(str, histogram["buckets"]), histogram["counts"])
+                        ),
+                    }
+                )
+            for job in self.jobs:
+                lines.append({"type": "job", **job})
+        return [json.dumps(line) for line in lines]
+
+    def toPrometheus(self):
+        """
+        Returns metrics in Prometheus text exposition format
+        """
+        output = []
+        with self.lock:
+            for name in sorted({name for name, labels in self.counters}):
+                output.append(f"# TYPE {self.prefix}_{name}_total counter")
+                for (series, labels), value in sorted(self.counters.items()):
+                    if series == name:
+                        output.append(
+                            f"{self.prefix}_{name}_total{formatLabels(labels)} {value}"
+                        )
+            for name in sorted({name for name, labels in self.histograms}):
+                output.append(f"# TYPE {self.prefix}_{name} histogram")
+                for (series, labels), histogram in sorted(self.histograms.items()):
+                    if series != name:
+                        continue
+                    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                        bucket_labels = labels + (("le", str(bound)),)
+                        output.append(
+                            f"{self.prefix}_{name}_bucket{formatLabels(bucket_labels)} {count}"
+                        )
+                    inf_labels = labels + (("le", "+Inf"),)
+                    output.append(
+                        f"{self.prefix}_{name}_bucket{formatLabels(inf_labels)} {histogram['count']}"
+                    )
+                    output.append(
+                        f"{self.prefix}_{name}_sum{formatLabels(labels)} {histogram['sum']}"
+                    )
+                    output.append(
+                        f"{self.prefix}_{name}_count{formatLabels(labels)} {histogram['count']}"
+                    )
+        return "\n".join(output) + "\n"
+
+    def export(self, directory):
+        """
+        Write metrics.jsonl & metrics.prom to directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "metrics.jsonl"), "w") as a:
+            a.write("\n".join(self.toJSONLines()) + "\n")
+        with open(os.path.join(directory, "metrics.prom"), "w") as a:
+            a.write(self.toPrometheus())
+
+
+def formatLabels(labels):
+    """
+    Format (name, value) label pairs for Prometheus
+    """
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def endpointName(url):
+    """
+    Short label for an API URL, such as "authrequest" or "poll"
+    """
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+# Shared by everything in this process
+metrics = Metrics()
@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+
+
+class Console:
+    """
+    Stands in for a rich Console, which is only imported & created the first
+    time something is actually printed
+
+    Importing rich takes a noticeable share of each script's start-up time, so
+    runs with --quiet never load it at all. All scripts & smartaccount share
+    the one console below.
+    """
+
+    def __init__(self):
+        self.quiet = False
+        self.console = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.console is None:
+            with self.lock:
+                if self.console is None:
+                    from rich.console import Console as RichConsole
+
+                    self.console = RichConsole()
+        return self.console
+
+    def print(self, *objects, **kwargs):
+        if not self.quiet:
+            self.load().print(*objects, **kwargs)
+
+    def step(self, text, title):
+        """
+        Print a numbered step heading, as a panel sized to its text
+        """
+        if not self.quiet:
+            from rich.panel import Panel
+
+            self.print()
+            self.print(Panel.fit(text, title=title))
+
+
+console = Console()
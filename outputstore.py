@@ -0,0 +1,167 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import copy
+import hashlib
+import io
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+from storage import writeFileAtomic
+
+MANIFEST_FILE = "manifest.jsonl"
+
+# Anything outside these characters is replaced in file & directory names
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
+
+# Output files are meant to be copied around, so aren't restricted to the
+# current user like caches are
+FILE_MODE = 0o644
+
+
+def safeName(value):
+    """
+    Returns value with any characters that aren't safe in a file name replaced
+    """
+    return UNSAFE_CHARACTERS.sub("_", str(value))
+
+
+def newBatchID():
+    """
+    Returns a unique, time-ordered ID for one run's worth of outputs
+    """
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + secrets.token_hex(3)
+
+
+class OutputStore:
+    """
+    Directory of license & ACK files, keyed by device UDI & job
+
+    Each output is written to <PID>_<SERIAL>/<kind>_<poll ID>.txt via a temp
+    file & rename, so runs never overwrite each other & readers never see a
+    partial file. Every file is also recorded in a JSON lines manifest with the
+    device, entitlements, SHA-256 & time it was written. All outputs from a run
+    share a batch ID, which is used to bundle them up for transfer.
+
+    In multi-tenant runs each tenant's outputs go under a <tenant>/ directory,
+    see forTenant().
+    """
+
+    def __init__(self, root, batch=None, tenant=None):
+        self.root = root
+        self.batch = batch or newBatchID()
+        self.tenant = tenant
+        self.manifest = os.path.join(root, MANIFEST_FILE)
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def save(self, kind, pid, serial, job, data, entitlements=None):
+        """
+        Save one output file & add it to the manifest
+
+        kind is the type of output, like "lic" or "ack". job is the Poll ID
+        of the request that produced it. Returns the saved file's path
+        """
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        relative = os.path.join(
+            safeName(f"{pid}_{serial}"), f"{safeName(kind)}_{safeName(job)}.txt"
+        )
+        if self.tenant:
+            relative = os.path.join(safeName(self.tenant), relative)
+        path = os.path.join(self.root, relative)
+        writeFileAtomic(path, data, FILE_MODE)
+        entry = {
+            "batch": self.batch,
+            "kind": kind,
+            "pid": pid,
+            "serial": serial,
+            "job": str(job),
+            "entitlements": sorted(entitlements or []),
+            "path": relative.replace(os.sep, "/"),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "bytes": len(data),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        if self.tenant:
+            entry["tenant"] = self.tenant
+        # Each entry is a single append, so concurrent writers don't interleave
+        with self.lock, open(self.manifest, "a") as a:
+            a.write(json.dumps(entry) + "\n")
+        return path
+
+    def forTenant(self, tenant):
+        """
+        Returns a view of this store that saves under a tenant's directory
+
+        The view shares this store's batch & manifest, so one bundle covers
+        every tenant in a run
+        """
+        store = copy.copy(self)
+        store.tenant = tenant
+        return store
+
+    def entries(self, batch=None):
+        """
+        Returns manifest entries, optionally only those from one batch
+        """
+        if not os.path.exists(self.manifest):
+            return []
+        entries = []
+        with open(self.manifest, "r") as a:
+            for line in a:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if batch is None or entry["batch"] == batch:
+                    entries.append(entry)
+        return entries
+
+    def bundle(self, path, batch=None):
+        """
+        Pack outputs into a single gzipped tar file, for one transfer into the
+        air-gapped network
+
+        Defaults to this store's current batch. Files are streamed into the
+        archive one at a time, with their manifest entries as manifest.jsonl.
+        Returns the number of files bundled
+        """
+        import tarfile
+
+        entries = self.entries(batch or self.batch)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as a:
+                with tarfile.open(fileobj=a, mode="w:gz", compresslevel=6) as tar:
+                    for entry in entries:
+                        tar.add(os.path.join(self.root, entry["path"]), entry["path"])
+                    manifest = "".join(json.dumps(entry) + "\n" for entry in entries)
+                    manifest = manifest.encode("utf-8")
+                    info = tarfile.TarInfo(MANIFEST_FILE)
+                    info.size = len(manifest)
+                    info.mtime = time.time()
+                    tar.addfile(info, io.BytesIO(manifest))
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return len(entries)
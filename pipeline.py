@@ -0,0 +1,150 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from metrics import metrics
+
+# Items each queue between two stages can hold before the stage feeding it waits
+QUEUE_SIZE = 100
+
+# Default worker threads for each stage of the batch flows. Each poll worker
+# follows one Smart Licensing task until it finishes
+SUBMIT_WORKERS = 2
+POLL_WORKERS = 50
+DECODE_WORKERS = 2
+WRITE_WORKERS = 2
+
+# Put in a stage's queue once per worker after its last item
+DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of a Pipeline
+
+    fn(item) is called on one of workers threads & returns the item to pass to
+    the next stage, or None to stop there. With fan_out, fn returns a list of
+    items instead
+    """
+
+    name: str
+    fn: object
+    workers: int = 1
+    fan_out: bool = False
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, each on its own pool of worker threads
+
+    Stages are connected by bounded queues, so items flow through as soon as
+    each stage is done with them, & a slow stage makes the stages feeding it
+    wait rather than pile up items in memory. If any stage raises, no more
+    items are taken in & those still waiting for the first stage are drained
+    without being processed. Items already past the first stage carry on to
+    the end, so work that was started (like a submitted task) is still
+    followed through, then run() re-raises the first error.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add(self, name, fn, workers=1, fan_out=False):
+        """
+        Add a stage to the end of the pipeline
+        """
+        self.stages.append(Stage(name, fn, max(workers, 1), fan_out))
+
+    def run(self, items):
+        """
+        Feed items through every stage & wait for all of them to finish
+
+        items can be any iterable & is only read as fast as the first stage
+        takes items. Returns dict of stage name -> number of items processed
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        counts = {stage.name: 0 for stage in self.stages}
+        running = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        failed = threading.Event()
+        errors = []
+
+        def work(index):
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                item = inbox.get()
+                if item is DONE:
+                    break
+                if failed.is_set() and index == 0:
+                    # Keep draining, so the feeder never blocks on a full queue
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = stage.fn(item)
+                except Exception as e:
+                    errors.append(e)
+                    failed.set()
+                    continue
+                metrics.observe(
+                    "pipeline_stage_seconds",
+                    time.perf_counter() - start,
+                    stage=stage.name,
+                )
+                with lock:
+                    counts[stage.name] += 1
+                if outbox is None or result is None:
+                    continue
+                for output in result if stage.fan_out else [result]:
+                    outbox.put(output)
+            # The last worker of a stage to finish stops the next stage
+            with lock:
+                running[index] -= 1
+                last = running[index] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put(DONE)
+
+        threads = [
+            threading.Thread(
+                target=work, args=(index,), name=f"{stage.name}-{n}", daemon=True
+            )
+            for index, stage in enumerate(self.stages)
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in items:
+                if failed.is_set():
+                    break
+                queues[0].put(item)
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(DONE)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return counts
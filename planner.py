@@ -0,0 +1,131 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from dataclasses import dataclass, field
+
+from inventory import Device
+
+
+@dataclass
+class Plan:
+    """
+    Changes needed to bring the fleet in line with a desired-state inventory
+
+    reserve lists Devices with just the entitlement counts they still need on
+    top of what's reserved. returns lists Devices with the remove_code to
+    return their licenses with, which happens before anything is reserved.
+    reports holds usage report chunks still to upload. blocked lists (Device,
+    reason) for changes that can't be made yet, such as a return with no
+    remove code
+    """
+
+    reserve: list = field(default_factory=list)
+    returns: list = field(default_factory=list)
+    reports: list = field(default_factory=list)
+    blocked: list = field(default_factory=list)
+    in_progress: int = 0
+    unchanged: int = 0
+
+    @property
+    def empty(self):
+        """
+        Returns True if there is nothing to send to Smart Licensing
+        """
+        return not (self.reserve or self.returns or self.reports)
+
+
+def missingEntitlements(desired, reserved):
+    """
+    Compare a device's desired & reserved entitlements
+
+    Returns (dict of entitlement counts still to reserve, True if anything
+    reserved has to be returned first). A reservation can only be added to, so
+    counts to reserve are on top of what's already reserved, & dropping an
+    entitlement or lowering its count means returning the device's licenses &
+    reserving what's wanted again
+    """
+    needs_return = any(
+        tag not in desired or count > desired[tag] for tag, count in reserved.items()
+    )
+    if needs_return:
+        return dict(desired), True
+    return {
+        tag: count - reserved.get(tag, 0)
+        for tag, count in desired.items()
+        if count > reserved.get(tag, 0)
+    }, False
+
+
+def planFleet(
+    desired, reserved, virtual_account, removal_codes=None, in_progress=(), reports=()
+):
+    """
+    Diff a desired-state inventory against the reservation index
+
+    desired is a list of Devices, as read by inventory.loadInventory. reserved
+    is a dict of UDI -> ReservedDevice, from ReservationIndex.reserved.
+    Devices reserved in another Virtual Account are moved by returning &
+    reserving them again. removal_codes is a dict of UDI -> Device with a
+    remove_code, for devices that need returning. Devices in in_progress
+    already have a request outstanding & are left alone. reports are usage
+    report chunks with only new usage, which are uploaded as they are.
+
+    Returns Plan with the fewest operations that reach the desired state
+    """
+    removal_codes = removal_codes or {}
+    in_progress = set(in_progress)
+    plan = Plan(reports=list(reports))
+
+    def returnDevice(pid, serial, reason):
+        # Returns a device's licenses. Returns False if there's no remove code
+        code = removal_codes.get((pid, serial))
+        if code is None:
+            plan.blocked.append((Device(pid, serial), f"{reason}, needs remove code"))
+            return False
+        plan.returns.append(code)
+        return True
+
+    wanted = set()
+    for device in desired:
+        wanted.add(device.udi)
+        if device.udi in in_progress:
+            plan.in_progress += 1
+            continue
+        current = reserved.get(device.udi)
+        if current is None:
+            entitlements, needs_return = dict(device.entitlements), False
+        elif current.virtual_account not in (None, virtual_account):
+            entitlements, needs_return = dict(device.entitlements), True
+        else:
+            entitlements, needs_return = missingEntitlements(
+                device.entitlements, current.entitlements
+            )
+        if needs_return and not returnDevice(*device.udi, "Reservation changed"):
+            continue
+        if not entitlements:
+            plan.unchanged += 1
+            continue
+        plan.reserve.append(
+            Device(device.pid, device.serial, device.hostname, entitlements)
+        )
+
+    # Anything reserved that's no longer in the inventory is returned
+    for udi in sorted(reserved):
+        if udi in wanted:
+            continue
+        if udi in in_progress:
+            plan.in_progress += 1
+            continue
+        returnDevice(*udi, "Not in inventory")
+    return plan
@@ -0,0 +1,230 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+
+from metrics import metrics
+from transport import SmartLicensingError
+
+# How long a task is polled before giving up on it, in seconds
+POLL_TIMEOUT = 1800
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter for polling a Smart Licensing task
+
+    Each call to next() returns how long to wait before the next attempt.
+    Delays start at initial & grow by factor up to max_delay, with a random
+    jitter so many jobs started together don't poll in lock-step.
+    """
+
+    def __init__(self, initial=1.0, factor=2.0, max_delay=30.0, jitter=0.5):
+        self.initial = initial
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.initial * (self.factor**self.attempts), self.max_delay)
+        self.attempts += 1
+        # Keep (1 - jitter) of the delay & randomize the rest
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+
+def backoffFor(action):
+    """
+    Returns a Backoff tuned for the given poll action
+
+    RUM/usage reports take a while to process, so acknowledgement polls
+    start slower than authorization polls
+    """
+    if "ack" in action:
+        return Backoff(initial=5.0, max_delay=60.0)
+    return Backoff()
+
+
+@dataclass
+class PollJob:
+    """
+    An outstanding Smart Licensing task to poll until completion
+
+    headers are the device-specific headers used to submit the task & context
+    can hold anything the caller needs to match the result back up (devices, etc).
+    error is set if the task failed or could not be polled. stopped is set if
+    polling gave up before Smart Licensing reported an outcome, so the task is
+    left outstanding for a later run to resume
+    """
+
+    poll_id: int
+    action: str
+    headers: dict = None
+    context: object = None
+    attempts: int = field(default=0, compare=False)
+    error: str = field(default=None, compare=False)
+    stopped: bool = field(default=False, compare=False)
+
+    @property
+    def status(self):
+        """
+        Outcome of the job once polling is over: COMPLETE, FAILED or STOPPED
+        """
+        if self.stopped:
+            return "STOPPED"
+        return "FAILED" if self.error else "COMPLETE"
+
+    def stop(self, reason):
+        """
+        Give up polling without an outcome from Smart Licensing
+        """
+        self.stopped = True
+        self.error = f"{reason}. Still outstanding, run again to resume it"
+
+
+def checkStatus(job, response):
+    """
+    Count a status check against job & work out whether its task has finished
+
+    Returns (response, done). Response is only kept once the task completes.
+    If the task failed, done is set & the error saved on the job
+    """
+    job.attempts += 1
+    # Status OK_POLL means still working, COMPLETE means the request has finished
+    if response["status"] == "COMPLETE":
+        return response, True
+    if response["status"] != "OK_POLL" or response["message"]:
+        job.error = f"{response['status']}: {response.get('message_code')}"
+        return None, True
+    return None, False
+
+
+class PollScheduler:
+    """
+    Polls many Smart Licensing tasks concurrently on a single event loop
+
+    Each job backs off independently, and the blocking HTTP calls run on worker
+    threads, so total wait time approaches the slowest job rather than the sum
+    of all jobs.
+    """
+
+    def __init__(self, sa, max_concurrency=10, timeout=POLL_TIMEOUT):
+        self.sa = sa
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    async def poll(self, job, limiter):
+        """
+        Poll a single job to completion & record its outcome in the run metrics
+        & job journal
+
+        Returns (job, response). Response is None if the task did not complete
+        """
+        start = time.monotonic()
+        job, response = await self.pollUntilDone(job, limiter)
+        self.finish(job, response, start)
+        return job, response
+
+    def pollOne(self, job):
+        """
+        Poll a single job to completion on the calling thread, for callers
+        that run each job on its own worker thread. Records its outcome like poll()
+
+        Returns (job, response). Response is None if the task did not complete
+        """
+        start = time.monotonic()
+        backoff = backoffFor(job.action)
+        deadline = start + self.timeout
+        response = None
+        while time.monotonic() < deadline:
+            time.sleep(backoff.next())
+            try:
+                status = self.sa.checkPollStatus(job.poll_id, job.action, job.headers)
+            except SmartLicensingError as e:
+                job.stop(e)
+                break
+            response, done = checkStatus(job, status)
+            if done:
+                break
+        else:
+            job.stop(f"Timed out after {self.timeout} seconds")
+        self.finish(job, response, start)
+        return job, response
+
+    def finish(self, job, response, start):
+        """
+        Record a finished job in the run metrics & job journal
+        """
+        metrics.recordJob(
+            job.poll_id, job.action, job.attempts, time.monotonic() - start, job.status
+        )
+        self.sa.finishJob(job, response)
+
+    async def pollUntilDone(self, job, limiter):
+        """
+        Poll a single job until it completes, fails or times out
+        """
+        import asyncio
+
+        backoff = backoffFor(job.action)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(backoff.next())
+            try:
+                async with limiter:
+                    response = await asyncio.to_thread(
+                        self.sa.checkPollStatus, job.poll_id, job.action, job.headers
+                    )
+            except SmartLicensingError as e:
+                # One failed job shouldn't stop the others from being polled
+                job.stop(e)
+                return job, None
+            response, done = checkStatus(job, response)
+            if done:
+                return job, response
+        job.stop(f"Timed out after {self.timeout} seconds")
+        return job, None
+
+    async def iterCompleted(self, jobs):
+        """
+        Async generator yielding (job, response) as each job finishes
+        """
+        import asyncio
+
+        limiter = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.ensure_future(self.poll(job, limiter)) for job in jobs]
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+
+    def pollAll(self, jobs, callback=None):
+        """
+        Poll all jobs to completion
+
+        callback(job, response) is called as soon as each job finishes.
+        Returns dict of poll ID -> response
+        """
+        # asyncio is slow to import & only needed once there's something to poll
+        import asyncio
+
+        async def runAll():
+            results = {}
+            async for job, response in self.iterCompleted(jobs):
+                results[job.poll_id] = response
+                if callback:
+                    callback(job, response)
+            return results
+
+        return asyncio.run(runAll())
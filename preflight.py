@@ -0,0 +1,267 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import binascii
+import csv
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from base64 import b64decode
+from dataclasses import dataclass, field
+
+from metrics import metrics
+from usagereport import entitlementTag, iterRUMElements, iterTaggedUsageItems
+
+# Fields every usage item signature needs
+SIGNATURE_FIELDS = ("signing_type", "value")
+
+# Where usage items that fail pre-flight checks are listed by default
+PREFLIGHT_REPORT = "preflight_errors.csv"
+
+# Columns of the per-item error report
+REPORT_FIELDS = [
+    "file",
+    "item",
+    "pid",
+    "serial",
+    "entitlement_tag",
+    "report_id",
+    "error",
+]
+
+
+@dataclass
+class PreflightResult:
+    """
+    Outcome of checking usage files before upload
+
+    errors are report rows for the items that failed, see REPORT_FIELDS.
+    checked counts every item read, including those for other license tags
+    """
+
+    errors: list = field(default_factory=list)
+    checked: int = 0
+
+
+def lookup(data, *path):
+    """
+    Returns the value at path in nested dicts, or None if any part is missing
+    """
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def sudiUDI(sudi):
+    """
+    Returns (PID, serial) from a sudi object, or None if it's incomplete
+    """
+    pid, serial = lookup(sudi, "udi_pid"), lookup(sudi, "udi_serial_number")
+    if not pid or not serial:
+        return None
+    return (pid, serial)
+
+
+def validateUsageItem(text, license_tags=None, default_udi=None):
+    """
+    Check the JSON text of one RUMReport element before it is uploaded
+
+    Checks the item's structure & required fields, that the payload is
+    untouched JSON with an entitlement tag & numeric report ID, that the
+    signature value is valid base64 & that the device that signed the item is
+    the device the payload reports on. Items for tags outside license_tags
+    aren't checked any further.
+
+    Returns (usage item, details, list of errors). details holds whatever
+    could be read of the item's tag, device & report ID, for the error report.
+    The usage item is None if there are errors or the tag isn't wanted
+    """
+    details = {}
+    try:
+        usage_item = json.loads(text)
+    except (TypeError, ValueError) as e:
+        return None, details, [f"Not valid JSON: {e}"]
+    payload = lookup(usage_item, "payload")
+    signature = lookup(usage_item, "signature")
+    if not isinstance(payload, str) or not payload:
+        return None, details, ["Missing payload"]
+    if not isinstance(signature, dict):
+        return None, details, ["Missing signature"]
+    # Items for other tags are dropped on the same targeted scan used to read
+    # them for upload, so only wanted payloads are parsed
+    try:
+        tag = entitlementTag(payload)
+    except ValueError:
+        # Anything that edits the payload text also breaks its signature
+        return None, details, ["Payload is not valid JSON, it may have been altered"]
+    except (KeyError, TypeError):
+        return None, details, ["Payload has no meta.entitlement_tag"]
+    if not tag or not isinstance(tag, str):
+        return None, details, ["Payload has no meta.entitlement_tag"]
+    details = {"entitlement_tag": tag}
+    if license_tags is not None and tag not in license_tags:
+        return None, details, []
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None, details, ["Payload is not valid JSON, it may have been altered"]
+    report_id = lookup(data, "meta", "report_id")
+    reported_udi = sudiUDI(lookup(data, "asset_identification", "instance", "sudi"))
+    details.update(report_id=report_id, udi=reported_udi)
+
+    errors = []
+    if report_id is not None and not str(report_id).isdigit():
+        errors.append(f"Report ID isn't a number: {report_id}")
+    for name in SIGNATURE_FIELDS:
+        if not signature.get(name):
+            errors.append(f"Signature has no {name}")
+    value = signature.get("value")
+    if value:
+        try:
+            b64decode(value, validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            errors.append("Signature value isn't valid base64")
+    # Items without a signing device belong to default_udi, see deviceUDI
+    sudi = signature.get("sudi")
+    signed_udi = default_udi if sudi is None else sudiUDI(sudi)
+    if sudi is not None and signed_udi is None:
+        errors.append("Signature sudi is missing a PID or serial")
+    elif signed_udi is None:
+        errors.append("Usage item has no device UDI")
+    elif reported_udi and tuple(signed_udi) != reported_udi:
+        errors.append(
+            f"Signed by {signed_udi[0]} SN {signed_udi[1]} but reports usage for"
+            f" {reported_udi[0]} SN {reported_udi[1]}"
+        )
+        details["udi"] = tuple(signed_udi)
+    if errors:
+        return None, details, errors
+    # The payload string is passed through untouched, see iterTaggedUsageItems
+    return {"payload": payload, "signature": signature}, details, []
+
+
+def rejectItem(result, usage_file, number, errors, details):
+    """
+    Add a report row for a usage item that failed pre-flight checks to result
+    """
+    pid, serial = details.get("udi") or ("", "")
+    result.errors.append(
+        {
+            "file": usage_file,
+            "item": number,
+            "pid": pid,
+            "serial": serial,
+            "entitlement_tag": details.get("entitlement_tag") or "",
+            "report_id": details.get("report_id") or "",
+            "error": "; ".join(errors),
+        }
+    )
+
+
+def iterCheckedFile(usage_file, result, license_tags=None, default_udi=None):
+    """
+    Stream & check every usage item in one usage file
+
+    Bad items are added to result's errors. Returns a generator of (license
+    tag, usage item) for the items that passed, in file order
+    """
+    number = 0
+    try:
+        for number, text in enumerate(iterRUMElements(usage_file), start=1):
+            result.checked += 1
+            usage_item, details, errors = validateUsageItem(
+                text, license_tags, default_udi
+            )
+            if usage_item:
+                yield details["entitlement_tag"], usage_item
+            elif errors:
+                rejectItem(result, usage_file, number, errors, details)
+    except (OSError, ET.ParseError) as e:
+        # Items before a break in the XML are still usable
+        rejectItem(result, usage_file, number + 1, [f"Can't read usage file: {e}"], {})
+
+
+def checkUsageFile(usage_file, license_tags=None, default_udi=None):
+    """
+    Check every usage item in one usage file, without keeping any of them
+
+    Runs in a worker process, so only takes & returns plain data.
+    Returns a PreflightResult for the file
+    """
+    result = PreflightResult()
+    for _ in iterCheckedFile(usage_file, result, license_tags, default_udi):
+        pass
+    return result
+
+
+def iterCheckedUsage(
+    usage_files, result, license_tags=None, default_udi=None, workers=None
+):
+    """
+    Stream usage items from many usage files, checking each one before it's
+    uploaded
+
+    Files are checked in parallel on a pool of worker processes, up to workers
+    at once (default: one per CPU), & each file's good items are then streamed
+    in order, leaving out the ones its worker rejected. A single file, or
+    workers=1, is checked as it's streamed in this process. Either way only
+    one item is held at a time & payloads are passed through untouched.
+    Bad items are added to result's errors. Returns a generator of (license
+    tag, usage item) for the items that passed
+    """
+    if isinstance(license_tags, str):
+        license_tags = {license_tags}
+    elif license_tags is not None:
+        license_tags = set(license_tags)
+    workers = min(workers or os.cpu_count() or 1, len(usage_files))
+    start = time.perf_counter()
+    errors = len(result.errors)
+    if workers <= 1:
+        for usage_file in usage_files:
+            yield from iterCheckedFile(usage_file, result, license_tags, default_udi)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            checked = pool.map(
+                checkUsageFile,
+                usage_files,
+                [license_tags] * len(usage_files),
+                [default_udi] * len(usage_files),
+            )
+            for usage_file, file_result in zip(usage_files, checked):
+                result.errors.extend(file_result.errors)
+                result.checked += file_result.checked
+                rejected = {error["item"] for error in file_result.errors}
+                try:
+                    yield from iterTaggedUsageItems(usage_file, license_tags, rejected)
+                except (OSError, ET.ParseError):
+                    # Already in the worker's errors
+                    pass
+    metrics.observe("preflight_seconds", time.perf_counter() - start)
+    metrics.inc("preflight_items", result.checked)
+    metrics.inc("preflight_errors", len(result.errors) - errors)
+
+
+def writeErrorReport(path, errors):
+    """
+    Save preflight errors as a CSV file, one row per rejected usage item
+    """
+    with open(path, "w", newline="") as a:
+        writer = csv.DictWriter(a, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(errors)
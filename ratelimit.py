@@ -0,0 +1,223 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+import time
+
+from metrics import metrics
+
+# Default request budgets in requests per second, by kind of API call
+AUTH_RATE = 1.0
+SUBMIT_RATE = 10.0
+POLL_RATE = 20.0
+OTHER_RATE = 5.0
+# Requests allowed in a burst, as a multiple of the per-second rate
+BURST_SECONDS = 2.0
+# When the API pushes back, rates can drop as low as this fraction of their budget
+MIN_RATE_FRACTION = 0.05
+# Each healthy response raises the rate by this fraction of its budget
+RATE_STEP_FRACTION = 0.02
+
+# Concurrency bounds for each kind of API call
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 10
+
+# Every API call falls into one of these, based on its endpoint name
+ENDPOINT_CATEGORIES = {
+    "token.oauth2": "auth",
+    "authrequest": "submit",
+    "reportusage": "submit",
+    "poll": "poll",
+}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, shared by all threads
+
+    Tokens refill at rate per second, up to burst. A rate of 0 or None means
+    no limit. The rate can be lowered & raised again within its original
+    budget with setRate().
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst or max(1.0, (rate or 0) * BURST_SECONDS)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available. Returns seconds waited
+        """
+        waited = 0.0
+        if not self.rate:
+            return waited
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def setRate(self, rate):
+        """
+        Change the refill rate, keeping it between MIN_RATE_FRACTION of the
+        original budget & the budget itself
+        """
+        if not self.max_rate:
+            return
+        with self.lock:
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, min(self.max_rate, rate))
+
+
+class ConcurrencyController:
+    """
+    Adaptive limit on requests in flight, using additive increase &
+    multiplicative decrease (AIMD)
+
+    Each healthy response raises the limit by 1/limit, so it grows by about one
+    per full round of requests. A throttled (429) or failed (5xx, timeout)
+    response cuts it by decrease. Responses much slower than the fastest seen
+    so far hold the limit where it is, since the API is starting to queue.
+    """
+
+    def __init__(
+        self,
+        initial=INITIAL_CONCURRENCY,
+        minimum=1,
+        maximum=MAX_CONCURRENCY,
+        decrease=0.5,
+        latency_tolerance=3.0,
+        cooldown=1.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.fastest = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free slot. Returns seconds waited
+        """
+        start = time.monotonic()
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, latency, congested=False):
+        """
+        Free a slot & adjust the limit based on how the request went
+
+        Returns True if the limit was cut back
+        """
+        cut = False
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if congested:
+                # Requests already in flight when the API pushed back will all
+                # report it, so only cut back once per cooldown
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.last_decrease = now
+                    cut = True
+            else:
+                self.fastest = (
+                    latency if self.fastest is None else min(self.fastest, latency)
+                )
+                if latency <= self.fastest * self.latency_tolerance:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+        return cut
+
+
+class RateLimiter:
+    """
+    Process-wide request budgets for the Smart Licensing APIs
+
+    Cisco SSO, task submissions (authrequest & reportusage) & task polls each
+    get their own token bucket & concurrency controller, so a flood of polls
+    can't starve new submissions or token refreshes.
+
+    Whenever the concurrency controller cuts back, the request rate is cut by
+    the same factor too, then climbs back towards its budget while responses
+    stay healthy. Concurrency alone can't stop a fast API from hitting a
+    rate limit.
+    """
+
+    def __init__(self, rates=None, max_concurrency=MAX_CONCURRENCY):
+        rates = {
+            "auth": AUTH_RATE,
+            "submit": SUBMIT_RATE,
+            "poll": POLL_RATE,
+            "other": OTHER_RATE,
+            **(rates or {}),
+        }
+        self.buckets = {category: TokenBucket(rate) for category, rate in rates.items()}
+        self.controllers = {
+            category: ConcurrencyController(maximum=max_concurrency)
+            for category in rates
+        }
+
+    def acquire(self, endpoint):
+        """
+        Wait until a request to endpoint is allowed. Returns its category,
+        which must be passed back to release()
+        """
+        category = ENDPOINT_CATEGORIES.get(endpoint, "other")
+        waited = self.buckets[category].acquire()
+        waited += self.controllers[category].acquire()
+        if waited:
+            metrics.observe("rate_limit_wait_seconds", waited, category=category)
+        return category
+
+    def release(self, category, latency, congested=False):
+        """
+        Report how a request went, freeing its concurrency slot
+        """
+        if congested:
+            metrics.inc("api_congestion", category=category)
+        controller = self.controllers[category]
+        bucket = self.buckets[category]
+        if controller.release(latency, congested):
+            bucket.setRate(bucket.rate * controller.decrease)
+        elif not congested and bucket.rate != bucket.max_rate:
+            bucket.setRate(bucket.rate + bucket.max_rate * RATE_STEP_FRACTION)
+
+    def limits(self):
+        """
+        Returns dict of category -> (current concurrency limit, current rate)
+        """
+        return {
+            category: (int(controller.limit), self.buckets[category].rate)
+            for category, controller in self.controllers.items()
+        }
@@ -0,0 +1,277 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import binascii
+import hashlib
+import json
+import os
+import time
+from base64 import b64decode
+from dataclasses import dataclass, field
+
+from config import DEFAULT_TENANT
+from storage import SQLiteStore
+
+DEFAULT_INDEX_FILE = os.path.join("~", ".smartlicensing", "reservations.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    tenant TEXT NOT NULL,
+    pid TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    virtual_account TEXT,
+    license_sha256 TEXT,
+    poll_id TEXT,
+    reserved_at REAL,
+    last_ack_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (tenant, pid, serial)
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    tenant TEXT NOT NULL,
+    pid TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (tenant, pid, serial, tag)
+);
+CREATE TABLE IF NOT EXISTS pending (
+    poll_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    pid TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    virtual_account TEXT,
+    entitlements TEXT,
+    submitted_at REAL NOT NULL,
+    PRIMARY KEY (poll_id, pid, serial)
+);
+"""
+
+# Any entitlement upsert also touches the device row, so both are written together
+UPSERT_DEVICE = """
+INSERT INTO devices (tenant, pid, serial, virtual_account, license_sha256,
+    poll_id, reserved_at, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (tenant, pid, serial) DO UPDATE SET
+    virtual_account = excluded.virtual_account,
+    license_sha256 = excluded.license_sha256,
+    poll_id = excluded.poll_id,
+    reserved_at = excluded.reserved_at,
+    updated_at = excluded.updated_at
+"""
+# Reserving adds to a device's existing count for each tag
+ADD_RESERVATION = """
+INSERT INTO reservations (tenant, pid, serial, tag, count, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (tenant, pid, serial, tag) DO UPDATE SET
+    count = count + excluded.count,
+    updated_at = excluded.updated_at
+"""
+UPSERT_ACK = """
+INSERT INTO devices (tenant, pid, serial, last_ack_at, updated_at)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (tenant, pid, serial) DO UPDATE SET
+    last_ack_at = excluded.last_ack_at,
+    updated_at = excluded.updated_at
+"""
+
+
+@dataclass
+class ReservedDevice:
+    """
+    What the index knows is reserved for a single device
+
+    entitlements maps each reserved license tag to its count. license_sha256
+    is the hash of the latest license file returned for the device, matching
+    the sha256 in an output store manifest
+    """
+
+    pid: str
+    serial: str
+    virtual_account: str = None
+    entitlements: dict = field(default_factory=dict)
+    license_sha256: str = None
+    reserved_at: float = None
+    last_ack_at: float = None
+
+    @property
+    def udi(self):
+        return (self.pid, self.serial)
+
+
+def licenseDigest(encoded):
+    """
+    Returns the SHA-256 hex digest of a base64 smart_license blob, or None if
+    it isn't valid
+    """
+    try:
+        return hashlib.sha256(
+            b64decode("".join((encoded or "").split()), validate=True)
+        ).hexdigest()
+    except binascii.Error:
+        return None
+
+
+def succeeded(authorization):
+    """
+    Returns True if a device's entry in an authorizations poll response succeeded
+    """
+    return authorization["status"] != "FAILED" and not authorization.get("error_code")
+
+
+class ReservationIndex(SQLiteStore):
+    """
+    Local record of what is reserved for every device, per tenant
+
+    Each reservation or removal request is noted as pending when it is
+    submitted, then applied once its poll response comes back: entitlement
+    counts that were issued are added to what the device had, removals that
+    succeeded clear the device, & ACKs set each device's last ACK time.
+    Nothing is changed for devices whose request failed, so the index only
+    ever reflects confirmed responses.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or DEFAULT_INDEX_FILE)
+
+    def submitted(
+        self, kind, poll_id, devices, virtual_account=None, tenant=DEFAULT_TENANT
+    ):
+        """
+        Note a newly submitted request for devices, until its response comes back
+
+        kind is the flow that submitted it: "reserve", "report" or "remove"
+        """
+        now = time.time()
+        rows = (
+            (
+                str(poll_id),
+                kind,
+                tenant,
+                device.pid,
+                device.serial,
+                virtual_account,
+                json.dumps(getattr(device, "entitlements", None) or {}),
+                now,
+            )
+            for device in devices
+        )
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pending (poll_id, kind, tenant, pid, serial,"
+                " virtual_account, entitlements, submitted_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def finish(self, poll_id, response):
+        """
+        Apply the response of a finished request to the devices it covered
+
+        A missing response means the whole request failed, so only the
+        pending record is dropped
+        """
+        now = time.time()
+        with self.lock, self.db:
+            pending = self.db.execute(
+                "SELECT kind, tenant, pid, serial, virtual_account, entitlements"
+                " FROM pending WHERE poll_id = ?",
+                (str(poll_id),),
+            ).fetchall()
+            self.db.execute("DELETE FROM pending WHERE poll_id = ?", (str(poll_id),))
+            if not pending or not response:
+                return
+            kind, tenant = pending[0][:2]
+            devices = {(row[2], row[3]): row for row in pending}
+            if kind == "reserve":
+                self.applyReservations(tenant, devices, response, str(poll_id), now)
+            elif kind == "remove":
+                self.applyRemovals(tenant, devices, response, now)
+            elif kind == "report":
+                self.applyAcks(tenant, devices, response, now)
+
+    def applyReservations(self, tenant, devices, response, poll_id, now):
+        # Called with the lock held, inside a transaction
+        for authorization in response["data"]["authorizations"]:
+            sudi = authorization["sudi"]
+            udi = (sudi["udi_pid"], sudi["udi_serial_number"])
+            digest = licenseDigest(authorization.get("smart_license"))
+            if udi not in devices or not succeeded(authorization) or not digest:
+                continue
+            virtual_account, entitlements = devices[udi][4:6]
+            self.db.execute(
+                UPSERT_DEVICE,
+                (tenant, *udi, virtual_account, digest, poll_id, now, now),
+            )
+            self.db.executemany(
+                ADD_RESERVATION,
+                [
+                    (tenant, *udi, tag, int(count), now)
+                    for tag, count in json.loads(entitlements).items()
+                ],
+            )
+
+    def applyRemovals(self, tenant, devices, response, now):
+        # Called with the lock held, inside a transaction
+        for authorization in response["data"]["authorizations"]:
+            sudi = authorization["sudi"]
+            udi = (sudi["udi_pid"], sudi["udi_serial_number"])
+            if udi not in devices or not succeeded(authorization):
+                continue
+            self.db.execute(
+                "DELETE FROM reservations WHERE tenant = ? AND pid = ? AND serial = ?",
+                (tenant, *udi),
+            )
+            self.db.execute(
+                "UPDATE devices SET virtual_account = NULL, license_sha256 = NULL,"
+                " reserved_at = NULL, updated_at = ?"
+                " WHERE tenant = ? AND pid = ? AND serial = ?",
+                (now, tenant, *udi),
+            )
+
+    def applyAcks(self, tenant, devices, response, now):
+        # Called with the lock held, inside a transaction
+        for ack in response["data"]["acknowledgements"]:
+            sudi = ack["sudi"]
+            udi = (sudi["udi_pid"], sudi["udi_serial_number"])
+            if udi in devices:
+                self.db.execute(UPSERT_ACK, (tenant, *udi, now, now))
+
+    def reserved(self, tenant=DEFAULT_TENANT):
+        """
+        Returns dict of UDI -> ReservedDevice for every device with at least
+        one reservation
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT r.pid, r.serial, r.tag, r.count, d.virtual_account,"
+                " d.license_sha256, d.reserved_at, d.last_ack_at"
+                " FROM reservations r LEFT JOIN devices d"
+                " ON d.tenant = r.tenant AND d.pid = r.pid AND d.serial = r.serial"
+                " WHERE r.tenant = ?",
+                (tenant,),
+            ).fetchall()
+        devices = {}
+        for pid, serial, tag, count, *details in rows:
+            device = devices.get((pid, serial))
+            if device is None:
+                device = devices[(pid, serial)] = ReservedDevice(
+                    pid, serial, details[0], {}, *details[1:]
+                )
+            device.entitlements[tag] = count
+        return devices
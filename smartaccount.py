@@ -12,18 +12,51 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
-import re
-import requests
+import binascii
+import copy
+import functools
 import json
-import os
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-from dotenv import load_dotenv
-from rich.console import Console
 import time
 import string
 import secrets
+from base64 import b64decode
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from accountindex import AccountLookupError, lookupVirtualAccounts
+from config import (
+    API_MAX_CONCURRENCY,
+    API_RATE_AUTH,
+    API_RATE_POLL,
+    API_RATE_SUBMIT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRIES,
+    JOB_JOURNAL,
+    RESERVATION_INDEX,
+    SMART_LICENSING_AUTH_URL,
+    SMART_LICENSING_BASE_URL,
+    UPLOAD_GZIP,
+    UPLOAD_STREAMING,
+    USAGE_INDEX,
+)
+from inventory import Device
+from journal import JobJournal
+from metrics import endpointName, metrics
+from pollscheduler import POLL_TIMEOUT, PollJob, backoffFor, checkStatus
+from ratelimit import RateLimiter
+from reservationindex import ReservationIndex
+from output import console
+from tenants import defaultTenant, tenantCaches
+from transport import (
+    RETRY_STATUSES,
+    JSONBody,
+    SmartLicensingError,
+    TransportError,
+    createSession,
+    jsonBody,
+    raiseForStatus,
+)
+from usageindex import UsageIndex
 
 # Cisco Smart Account URLs & API paths
 AUTH_URL = "https://cloudsso.cisco.com/as/token.oauth2"
@@ -38,62 +71,187 @@ NONCE = "".join(
     (secrets.choice(string.ascii_letters + string.digits) for i in range(16))
 )
 
-# Load environment variables
-load_dotenv()
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-SMART_ACCOUNT = os.getenv("SMART_ACCOUNT")
-VIRTUAL_ACCOUNT = os.getenv("VIRTUAL_ACCOUNT")
-LICENSE_TAG = os.getenv("LICENSE_TAG")
+# API endpoints can be overridden, such as to test against a local mock server
+AUTH_URL = SMART_LICENSING_AUTH_URL or AUTH_URL
+BASE_URL = SMART_LICENSING_BASE_URL or BASE_URL
+
+# Used if SSO doesn't tell us how long a token is valid for
+DEFAULT_TOKEN_LIFETIME = 3599
+
+# Most device header sets kept in memory at once
+DEVICE_HEADER_CACHE_SIZE = 10000
+
+# Shared by every tenant. Each tenant gets its own token cache & account index
+job_journal = JobJournal(JOB_JOURNAL)
+usage_index = UsageIndex(USAGE_INDEX)
+reservation_index = ReservationIndex(RESERVATION_INDEX)
+rate_limiter = RateLimiter(
+    {"auth": API_RATE_AUTH, "submit": API_RATE_SUBMIT, "poll": API_RATE_POLL},
+    API_MAX_CONCURRENCY,
+)
+
+
+@functools.lru_cache(maxsize=DEVICE_HEADER_CACHE_SIZE)
+def deviceHeaders(smart_account_id, virtual_account_id, pid, serial):
+    """
+    Returns the HTTP headers required for device-specific requests
+
+    For device-specific requests, we need to send the device PID & serial in
+    the HTTP headers - as well as the target SA/VA IDs. Headers are built once
+    per SA, VA & device & shared from then on, so they must not be modified
+    """
+    return {
+        "Content-Type": "application/json",
+        "X-CSW-SMART-ACCOUNT-ID": f"{smart_account_id}",
+        "X-CSW-VIRTUAL-ACCOUNT-ID": f"{virtual_account_id}",
+        "X-CSW-REQUESTING-SYSTEM": json.dumps(
+            {
+                "udi_pid": f"{pid}",
+                "udi_serial_number": f"{serial}",
+            }
+        ),
+    }
+
+
+def decodeSmartLicense(encoded):
+    """
+    Decode the base64 smart_license blob of an authorization or acknowledgement
+
+    Returns the license or ACK text. Raises ValueError if the blob is missing,
+    isn't valid base64 or doesn't decode to UTF-8 text
+    """
+    if not encoded:
+        raise ValueError("No license data in response")
+    try:
+        # Line breaks are allowed, anything else outside the alphabet is not
+        return b64decode("".join(encoded.split()), validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid license data: {e}") from e
 
 
-console = Console()
+def setQuiet(quiet):
+    """
+    Turn console output from Smart Licensing requests on or off
+    """
+    console.quiet = quiet
 
 
 class SmartAccount:
-    def __init__(self):
-        self.s = requests.Session()
+    def __init__(self, tenant=None):
+        # Credentials & accounts come from .env unless a tenant is given
+        self.tenant = tenant or defaultTenant()
+        self.token_cache, self.account_index = tenantCaches(self.tenant)
+        self.s = createSession(HTTP_POOL_SIZE, HTTP_RETRIES)
         self.auth_token = {}
+        self.token_expires_at = None
         self.device_headers = None
+        self.journal = job_journal
+        self.usage_index = usage_index
+        self.reservations = reservation_index
+        # How usage report bodies are encoded, see transport.jsonBody
+        self.stream_uploads = UPLOAD_STREAMING
+        self.compress_uploads = UPLOAD_GZIP
 
-    def getAuthToken(self):
+    def clone(self):
+        """
+        Returns a SmartAccount sharing this one's HTTP session, access token &
+        account IDs, but with its own device headers
+
+        Lets worker threads submit device-specific requests side by side without
+        authenticating or looking up accounts again
+        """
+        sa = copy.copy(self)
+        sa.device_headers = None
+        return sa
+
+    @metrics.timed("operation_seconds", operation="auth")
+    def getAuthToken(self, force=False):
         """
         Request access token to Smart License APIs
+
+        A still-valid token from the token cache is reused unless force is set
         """
+        if not force:
+            cached = self.token_cache.get(self.tenant.client_id)
+            if cached:
+                metrics.inc("token_cache_hits")
+                self.setAuthToken(*cached)
+                console.print("[green]Using cached Auth Token")
+                return
         form_data = {
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
+            "client_id": self.tenant.client_id,
+            "client_secret": self.tenant.client_secret,
             "grant_type": "client_credentials",
         }
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         console.print("Sending authentication request...")
         response = self.postData(AUTH_URL, form_data, headers)
         # Pull token out of response & save for all future requests
-        token = json.loads(response)["access_token"]
-        self.auth_token = {"Authorization": f"Bearer {token}"}
+        token_data = json.loads(response)
+        token = token_data["access_token"]
+        expires_at = self.token_cache.put(
+            self.tenant.client_id,
+            token,
+            token_data.get("expires_in", DEFAULT_TOKEN_LIFETIME),
+        )
+        self.setAuthToken(token, expires_at)
         console.print("[green]Got Auth Token")
 
-    def getAccountIDs(self):
+    def setAuthToken(self, token, expires_at):
         """
-        Queries Smart Account for account info. Saves Smart Account &
-        Virtual Account IDs, which are required for most requests
+        Saves access token headers used by all future requests
+        """
+        self.auth_token = {"Authorization": f"Bearer {token}"}
+        self.token_expires_at = expires_at
+
+    def refreshAuthToken(self):
+        """
+        Proactively refreshes the access token if it is close to expiring
+        """
+        if self.token_expires_at and self.token_cache.isExpiring(self.token_expires_at):
+            self.getAuthToken()
+
+    @metrics.timed("operation_seconds", operation="account_lookup")
+    def getAccountIDs(self, refresh=False):
+        """
+        Looks up Smart Account & Virtual Account IDs, which are required for
+        most requests. Uses the local account index unless it is stale or
+        refresh is set
         """
-        response = self.getData(BASE_URL + SMART_ACCOUNT_URL)
         console.print("Looking up Smart Account & Virtual Account IDs...")
-        accounts = json.loads(response)["accounts"]
+        self.smart_account_id, va_ids = self.resolveVirtualAccounts(
+            [self.tenant.virtual_account], refresh
+        )
+        self.virtual_account_id = va_ids[self.tenant.virtual_account]
+        console.print(f"Found SA ID: {self.smart_account_id}")
+        console.print(f"Found VA ID: {self.virtual_account_id}")
+
+    def resolveVirtualAccounts(self, names, refresh=False):
+        """
+        Resolve many Virtual Account names in the tenant's Smart Account
+
+        Returns (Smart Account ID, dict of VA name -> VA ID). Raises
+        AccountLookupError if the SA or any VA can't be found
+        """
+        index = None if refresh else self.account_index.get(self.tenant.client_id)
+        if index:
+            try:
+                return lookupVirtualAccounts(index, self.tenant.smart_account, names)
+            except AccountLookupError:
+                # Account may have been created since the index was saved
+                console.print("[yellow]Not found in account index. Refreshing...")
+        index = self.downloadAccountIndex()
+        return lookupVirtualAccounts(index, self.tenant.smart_account, names)
+
+    def downloadAccountIndex(self):
+        """
+        Queries Smart Account for account info & rebuilds the local account index
+        """
+        response = self.getData(BASE_URL + SMART_ACCOUNT_URL)
         # Response JSON should contain all smart accounts that we have access to with
-        # our credentials.
-        # So we'll need to find the one we want to use & save it's ID
-        for smart_account in accounts:
-            if (smart_account["domain"]).lower() == (SMART_ACCOUNT).lower():
-                self.smart_account_id = smart_account["account_id"]
-                console.print(f"Found SA ID: {self.smart_account_id}")
-                # Same goes for virtual account - Need to find which one we want &
-                # save the ID
-                for virtual_account in smart_account["virtual_accounts"]:
-                    if virtual_account["name"] == VIRTUAL_ACCOUNT:
-                        self.virtual_account_id = virtual_account["virtual_account_id"]
-                        console.print(f"Found VA ID: {self.virtual_account_id}")
+        # our credentials
+        accounts = json.loads(response)["accounts"]
+        return self.account_index.build(self.tenant.client_id, accounts)
 
     def requestAuthCode(self, pid, serial, hostname):
         """
@@ -101,6 +259,17 @@ class SmartAccount:
 
         Returns Poll ID, used to query task status & retrieve license
         """
+        device = Device(pid, serial, hostname, self.tenant.license_tags)
+        return self.requestAuthCodes([device]).poll_id
+
+    def requestAuthCodes(self, devices):
+        """
+        Request offline license authorization codes for a batch of devices
+
+        All devices are packed into a single request, so one Poll ID covers
+        the whole batch. Returns PollJob for the request, carrying its own
+        device headers & the batch, used to query task status & retrieve licenses
+        """
         url = BASE_URL + AUTH_REQUEST
         request_body = json.dumps(
             {
@@ -110,35 +279,86 @@ class SmartAccount:
                     "licenses": [
                         {
                             "sudi": {
-                                "udi_pid": f"{pid}",
-                                "udi_serial_number": f"{serial}",
+                                "udi_pid": f"{device.pid}",
+                                "udi_serial_number": f"{device.serial}",
                             },
-                            "hostname": f"{hostname}",
+                            "hostname": f"{device.hostname}",
                             "keys": [
                                 {
-                                    "entitlement": f"{LICENSE_TAG}",
-                                    "count": "1",
+                                    "entitlement": f"{entitlement}",
+                                    "count": f"{count}",
                                 }
+                                for entitlement, count in device.entitlements.items()
                             ],
                         }
+                        for device in devices
                     ],
                 }
             }
         )
-        # This is a device-specific request, which needs certain HTTP headers
-        if not self.device_headers:
-            self.createDeviceHeaders(pid, serial)
+        # This is a device-specific request, which needs certain HTTP headers.
+        # Batches are submitted on behalf of the first device in the list
+        headers = self.createDeviceHeaders(devices[0].pid, devices[0].serial)
         # Send Request
-        console.print("Submitting license reservation request")
-        response = self.postData(url, request_body, self.device_headers)
+        console.print(
+            f"Submitting license reservation request for {len(devices)} device(s)"
+        )
+        response = self.postData(url, request_body, headers)
         # Return poll id, which is used to check task status & get task results
         poll_id = json.loads(response)["poll_id"]
         console.print(f"Request submitted. Poll ID: {poll_id}")
-        return poll_id
+        return self.recordJob("reserve", poll_id, "authorizations", devices, headers)
+
+    def getPollRequest(self, poll_id, poll_type, headers=None, timeout=POLL_TIMEOUT):
+        """
+        Checks status of an existing task until it completes, fails or
+        timeout seconds pass
+
+        headers are the device headers the task was submitted with, & default
+        to those of the last device-specific request. Returns the completed
+        poll response, or None if the task failed or timed out
+        """
+        console.print("Checking task status...")
+
+        # RUM/usage reports can take a few minutes to process & give us a response,
+        # so polling backs off exponentially rather than hammering the API
+        if "ack" in poll_type:
+            console.print("\nReports can take a short while to process. Waiting...")
+        job = PollJob(poll_id, poll_type, headers)
+        backoff = backoffFor(poll_type)
+        start = time.monotonic()
+        response = None
+        while time.monotonic() < start + timeout:
+            # Wait between each attempt, a little longer each time
+            time.sleep(backoff.next())
+            try:
+                status = self.checkPollStatus(poll_id, poll_type, headers)
+            except SmartLicensingError as e:
+                job.stop(e)
+                break
+            response, done = checkStatus(job, status)
+            console.print(f"Attempt # {job.attempts}")
+            if done:
+                break
+            console.print("Task not completed yet. Waiting...")
+        else:
+            job.stop(f"Timed out after {timeout} seconds")
+        if response:
+            console.print("[green]Task Completed!")
+        else:
+            console.print("[yellow]Something went wrong")
+            console.print(f"Error: {job.error}")
+        metrics.recordJob(
+            poll_id, poll_type, job.attempts, time.monotonic() - start, job.status
+        )
+        self.finishJob(job, response)
+        return response
 
-    def getPollRequest(self, poll_id, poll_type):
+    def checkPollStatus(self, poll_id, poll_type, headers=None):
         """
-        Checks status of an existing task
+        Single status check of an existing task
+
+        headers defaults to the current device headers. Returns parsed poll response
         """
         url = BASE_URL + POLL_REQUEST
         request_body = json.dumps(
@@ -151,75 +371,46 @@ class SmartAccount:
                 }
             }
         )
-        console.print("Checking task status...")
-
-        # RUM/usage reports can take a few minutes to process & give us a response
-        # So we'll build in a buffer here before checking task status
-        if "ack" in poll_type:
-            console.print(
-                "\nReports can take a short while to process. Waiting 30 sec..."
-            )
-            time.sleep(27)
-        # Loop until response is received
-        attempts = 1
-        while True:
-            # Wait a few seconds between each attempt
-            time.sleep(3)
-            response = json.loads(self.postData(url, request_body, self.device_headers))
-            console.print(f"Attempt # {attempts}")
-            # Status OK_POLL means still working, COMPLETE means the request has finished
-            if response["status"] == "COMPLETE":
-                console.print("[green]Task Completed!")
-                return response
-            elif response["status"] == "OK_POLL":
-                if response["message"] == "":
-                    console.print("Task not completed yet. Waiting...")
-                    attempts += 1
-                else:
-                    console.print("[yellow]Something went wrong")
-                    console.print(f"Error: {response['message_code']}")
-                    break
+        response = self.postData(url, request_body, headers or self.device_headers)
+        metrics.inc("poll_requests", action=poll_type)
+        return json.loads(response)
 
     def createDeviceHeaders(self, pid, serial):
         """
-        Creates & saves headers that are required for device-specific requests
-        """
-        # For devices-pecific requests, we need to send the device PID & serial
-        # in the HTTP headers - as well as the target SA/VA IDs
-        self.device_headers = {
-            "Content-Type": "application/json",
-            "X-CSW-SMART-ACCOUNT-ID": f"{self.smart_account_id}",
-            "X-CSW-VIRTUAL-ACCOUNT-ID": f"{self.virtual_account_id}",
-            "X-CSW-REQUESTING-SYSTEM": json.dumps(
-                {
-                    "udi_pid": f"{pid}",
-                    "udi_serial_number": f"{serial}",
-                }
-            ),
-        }
+        Looks up & saves headers that are required for device-specific requests
+
+        Returns the headers
+        """
+        self.device_headers = deviceHeaders(
+            self.smart_account_id, self.virtual_account_id, pid, serial
+        )
+        return self.device_headers
 
     def sendUsageReport(self, report_data, pid, serial):
         """
         Generates License Usage report & sends to Smart Licensing
 
+        Aggregated reports can run to many MB, so the body can be streamed
+        as it is encoded &/or gzipped, per stream_uploads & compress_uploads.
         Returns Poll ID, used to query task status & retrieve ACK payload
         """
         url = BASE_URL + USAGE_REPORT
-        request_body = json.dumps(
+        request_body, encoding = jsonBody(
             {
                 "data": {
                     "timestamp": self.getTimestamp(),
                     "nonce": f"{NONCE}",
                     "reports": report_data,
                 }
-            }
+            },
+            self.stream_uploads,
+            self.compress_uploads,
         )
         # This is a device-specific request, which needs certain HTTP headers
-        if not self.device_headers:
-            self.createDeviceHeaders(pid, serial)
+        headers = self.createDeviceHeaders(pid, serial)
         # Send Request
         console.print("Submitting license usage report")
-        response = json.loads(self.postData(url, request_body, self.device_headers))
+        response = json.loads(self.postData(url, request_body, {**headers, **encoding}))
         # Catch if the report upload fails. Most commonly this will happen if we
         # try to upload a duplicate report
         if response["status"] == "FAILED":
@@ -229,14 +420,70 @@ class SmartAccount:
         # Return poll id, which is used to check task status & get task results
         poll_id = response["poll_id"]
         console.print(f"Request submitted. Poll ID: {poll_id}")
+        devices = [
+            Device(report["sudi"]["udi_pid"], report["sudi"]["udi_serial_number"])
+            for report in report_data
+        ]
+        self.recordJob("report", poll_id, "acknowledgements", devices, headers)
+        self.usage_index.record(poll_id, report_data)
         return poll_id
 
+    def sendUsageReports(self, chunks):
+        """
+        Sends multi-device usage reports, one request per upload chunk
+
+        Each chunk is submitted on behalf of the first device in it. If a chunk
+        is rejected, its devices are retried one at a time.
+        Returns (list of PollJobs for the uploads that were accepted, list of
+        device reports that were still rejected on their own)
+        """
+        jobs = []
+        rejected = []
+        for chunk in chunks:
+            sudi = chunk[0]["sudi"]
+            poll_id = self.sendUsageReport(
+                chunk, sudi["udi_pid"], sudi["udi_serial_number"]
+            )
+            if not poll_id and len(chunk) > 1:
+                # Smart Licensing rejects the whole upload if any one report is
+                # stale, so send each device on its own to let the rest through
+                console.print("Retrying each device report separately...")
+                retried, still_rejected = self.sendUsageReports(
+                    [[report] for report in chunk]
+                )
+                jobs.extend(retried)
+                rejected.extend(still_rejected)
+            elif poll_id:
+                # Each job keeps the headers it was submitted with, for polling
+                headers = self.createDeviceHeaders(
+                    sudi["udi_pid"], sudi["udi_serial_number"]
+                )
+                jobs.append(PollJob(poll_id, "acknowledgements", headers, chunk))
+            else:
+                console.print(
+                    f"[red]{sudi['udi_pid']} - SN: {sudi['udi_serial_number']}:"
+                    " usage report rejected"
+                )
+                rejected.extend(chunk)
+        return jobs, rejected
+
     def removeDeviceLicense(self, pid, serial, hostname, remove_code):
         """
         Remove device license from Smart Licensing
 
         Returns Poll ID, used to query task status
         """
+        device = Device(pid, serial, hostname, remove_code=remove_code)
+        return self.removeDeviceLicenses([device]).poll_id
+
+    def removeDeviceLicenses(self, devices):
+        """
+        Remove licenses from a batch of devices, using each device's remove_code
+
+        All devices are packed into a single request. Returns PollJob for the
+        request, carrying its own device headers & the batch, used to query
+        task status
+        """
         url = BASE_URL + AUTH_REQUEST
         request_body = json.dumps(
             {
@@ -246,26 +493,64 @@ class SmartAccount:
                     "licenses": [
                         {
                             "sudi": {
-                                "udi_pid": f"{pid}",
-                                "udi_serial_number": f"{serial}",
+                                "udi_pid": f"{device.pid}",
+                                "udi_serial_number": f"{device.serial}",
                             },
-                            "hostname": f"{hostname}",
+                            "hostname": f"{device.hostname}",
                             "keys": [],
-                            "remove_code": f"{remove_code}",
+                            "remove_code": f"{device.remove_code}",
                         }
+                        for device in devices
                     ],
                 }
             }
         )
-        if not self.device_headers:
-            self.createDeviceHeaders(pid, serial)
+        # Batches are submitted on behalf of the first device in the list
+        headers = self.createDeviceHeaders(devices[0].pid, devices[0].serial)
         # Send Request
-        console.print("Submitting license removal request")
-        response = self.postData(url, request_body, self.device_headers)
+        console.print(
+            f"Submitting license removal request for {len(devices)} device(s)"
+        )
+        response = self.postData(url, request_body, headers)
         # Return poll id, which is used to check task status & get task results
         poll_id = json.loads(response)["poll_id"]
         console.print(f"Request submitted. Poll ID: {poll_id}")
-        return poll_id
+        return self.recordJob("remove", poll_id, "authorizations", devices, headers)
+
+    def recordJob(self, kind, poll_id, action, devices, headers):
+        """
+        Saves a submitted request to the job journal, so polling can be resumed
+        if this run is interrupted, & notes it as pending in the reservation index
+
+        Returns PollJob for the request, with the devices it covers as context
+        """
+        job = PollJob(poll_id, action, headers, devices)
+        self.journal.record(kind, job, devices, NONCE, self.tenant.name)
+        self.reservations.submitted(
+            kind, poll_id, devices, self.tenant.virtual_account, self.tenant.name
+        )
+        return job
+
+    def outstandingJobs(self, kind, udi=None):
+        """
+        Returns this tenant's jobs left outstanding by an interrupted run
+        """
+        return self.journal.outstanding(kind, udi, self.tenant.name)
+
+    def finishJob(self, job, response):
+        """
+        Saves the outcome of a polled request to the job journal, usage index
+        & reservation index
+
+        Jobs that stopped being polled before Smart Licensing reported an
+        outcome are left as they are, so the next run resumes polling them
+        rather than submitting the same request again
+        """
+        if job.stopped:
+            return
+        self.journal.finish(job.poll_id, response, job.error)
+        self.usage_index.finish(job.poll_id, response)
+        self.reservations.finish(job.poll_id, response)
 
     def getData(self, get_url, headers={}):
         """
@@ -273,30 +558,94 @@ class SmartAccount:
 
         Returns response text
         """
-        headers = {**self.auth_token, **headers}
-        resp = self.s.get(get_url, headers=headers, verify=False)
-        if resp.status_code == 200:
-            return resp.text
-        if resp.status_code == 404:
-            return None
-        else:
-            console.print("[red]Request FAILED. " + str(resp.status_code))
-            console.print(resp.text)
+        return self.request("GET", get_url, headers=headers)
 
     def postData(self, post_url, post_data, headers={}):
         """
         General function for HTTP POST requests with authentication headers & a data payload
 
+        post_data may be a JSONBody, which is sent as it is encoded.
         Returns response text
         """
-        headers = {**self.auth_token, **headers}
-        resp = self.s.post(post_url, headers=headers, data=post_data, verify=False)
-        if resp.status_code >= 200 or resp.status_code <= 204:
-            return resp.text
-        else:
+        return self.request("POST", post_url, headers=headers, data=post_data)
+
+    def request(self, method, url, headers={}, data=None):
+        """
+        Sends an HTTP request with authentication headers
+
+        Returns response text. Raises a SmartLicensingError subclass if the
+        request fails, after any retries
+        """
+        is_auth = url == AUTH_URL
+        if not is_auth:
+            self.refreshAuthToken()
+        resp = self.send(method, url, headers, data)
+        # Token may have been revoked or expired early - re-authenticate once & retry
+        if resp.status_code == 401 and not is_auth and self.auth_token:
+            self.reauthenticate()
+            resp = self.send(method, url, headers, data)
+        if not 200 <= resp.status_code < 300:
             console.print("[red]Request FAILED. " + str(resp.status_code))
-            console.print(resp.text)
-            console.print(post_data)
+        raiseForStatus(resp)
+        return resp.text
+
+    def send(self, method, url, headers, data):
+        """
+        Sends a single request over the shared session
+
+        Every request waits its turn with the process-wide rate limiter, &
+        reports back whether the API pushed back so concurrency can adapt
+        """
+        # requests is only imported once the first session is created
+        from requests.exceptions import RequestException
+
+        endpoint = endpointName(url)
+        category = rate_limiter.acquire(endpoint)
+        start = time.perf_counter()
+        try:
+            resp = self.s.request(
+                method,
+                url,
+                headers={**self.auth_token, **headers},
+                data=data,
+                timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                verify=False,
+            )
+        except RequestException as e:
+            rate_limiter.release(category, time.perf_counter() - start, True)
+            metrics.inc("http_errors", endpoint=endpoint)
+            raise TransportError(f"{method} {url} failed: {e}") from e
+        elapsed = time.perf_counter() - start
+        metrics.observe(
+            "http_request_seconds", elapsed, method=method, endpoint=endpoint
+        )
+        metrics.inc("http_responses", endpoint=endpoint, status=resp.status_code)
+        # Streamed bodies have no length until they have been sent
+        sent = data.sent if isinstance(data, JSONBody) else len(resp.request.body or "")
+        metrics.inc("http_bytes_sent", sent, endpoint=endpoint)
+        metrics.inc("http_bytes_received", len(resp.content), endpoint=endpoint)
+        # Retries made by the transport for throttling & server errors
+        retries = getattr(resp.raw, "retries", None)
+        history = retries.history if retries else ()
+        if history:
+            metrics.inc("http_retries", len(history), endpoint=endpoint)
+        # Throttling & server errors count as congestion, even if a retry
+        # eventually got through
+        congested = resp.status_code in RETRY_STATUSES or any(
+            attempt.status in RETRY_STATUSES or attempt.error for attempt in history
+        )
+        rate_limiter.release(category, elapsed, congested)
+        return resp
+
+    def reauthenticate(self):
+        """
+        Discards a rejected access token & requests a new one
+        """
+        console.print("[yellow]Auth Token rejected. Re-authenticating...")
+        metrics.inc("reauthentications")
+        self.token_cache.invalidate(self.tenant.client_id)
+        self.auth_token = {}
+        self.getAuthToken(force=True)
 
     def getTimestamp(self):
         """
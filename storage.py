@@ -0,0 +1,93 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+def writeFileAtomic(path, data, mode=0o600):
+    """
+    Write data (str or bytes) to path via a temp file & rename
+
+    Readers never see a partially written file, and the file is created with
+    the given permissions rather than the process umask
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        os.chmod(temp_path, mode)
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as a:
+            a.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def readJSON(path, default=None):
+    """
+    Read a JSON file, returning default if it is missing or unreadable
+    """
+    try:
+        with open(path, "r") as a:
+            return json.load(a)
+    except (OSError, ValueError):
+        return default
+
+
+def writeJSONAtomic(path, data, mode=0o600):
+    """
+    Serialize data as JSON & write it atomically to path
+    """
+    writeFileAtomic(path, json.dumps(data), mode)
+
+
+class SQLiteStore:
+    """
+    Base for the local SQLite databases, like the job journal & usage index
+
+    The database is only opened once it is first used, with its directory
+    created private to the user. Subclasses set schema, & can override
+    migrate() to upgrade databases made by older versions. Writers hold lock
+    """
+
+    schema = ""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self.connection = None
+
+    @property
+    def db(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.schema)
+            self.migrate(self.connection)
+        return self.connection
+
+    def migrate(self, connection):
+        pass
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
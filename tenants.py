@@ -0,0 +1,230 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import glob
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+
+from accountindex import AccountIndex
+from config import (
+    ACCOUNT_INDEX,
+    ACCOUNT_INDEX_TTL,
+    CLIENT_ID,
+    CLIENT_SECRET,
+    DEFAULT_TENANT,
+    LICENSE_TAGS,
+    SMART_ACCOUNT,
+    TOKEN_CACHE,
+    VIRTUAL_ACCOUNT,
+)
+from inventory import parseEntitlements
+from output import console
+from outputstore import safeName
+from tokencache import TokenCache
+
+# Tenants from a config file get their own token cache & account index here,
+# unless the file says otherwise
+TENANT_DIR = os.path.join("~", ".smartlicensing", "tenants")
+
+# Every tenant in a tenant config file needs these
+REQUIRED_FIELDS = ("name", "client_id", "smart_account", "virtual_account")
+
+
+@dataclass
+class Tenant:
+    """
+    One set of API credentials & the Smart Account/Virtual Account they work in
+
+    license_tags maps each license tag to reserve to its count. inventory,
+    usage_files & removal_file are the inputs each script processes for this
+    tenant in a multi-tenant run
+    """
+
+    name: str
+    client_id: str
+    client_secret: str = field(repr=False)
+    smart_account: str
+    virtual_account: str
+    license_tags: dict = field(default_factory=dict)
+    token_cache: str = None
+    account_index: str = None
+    inventory: str = None
+    usage_files: list = field(default_factory=list)
+    removal_file: str = None
+
+
+def defaultTenant():
+    """
+    Returns the Tenant configured in .env
+    """
+    return Tenant(
+        DEFAULT_TENANT,
+        CLIENT_ID,
+        CLIENT_SECRET,
+        SMART_ACCOUNT,
+        VIRTUAL_ACCOUNT,
+        LICENSE_TAGS,
+        TOKEN_CACHE,
+        ACCOUNT_INDEX,
+    )
+
+
+def loadTenants(path):
+    """
+    Read a JSON tenant config file
+
+    The file holds a list of tenants, either bare or as {"tenants": [...]}.
+    Each needs a name, client_id, smart_account, virtual_account & either a
+    client_secret or client_secret_env, naming an environment variable (or .env
+    setting) that holds the secret. license_tag falls back to LICENSE_TAG.
+    Relative input paths are resolved against the config file's directory, &
+    usage_files may contain wildcards.
+
+    Returns list of Tenant objects
+    """
+    with open(path, "r") as a:
+        records = json.load(a)
+    if isinstance(records, dict):
+        records = records["tenants"]
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value):
+        return os.path.join(base, os.path.expanduser(value)) if value else None
+
+    tenants = []
+    for number, record in enumerate(records, start=1):
+        missing = [key for key in REQUIRED_FIELDS if not record.get(key)]
+        if missing:
+            raise ValueError(
+                f"{path}: tenant {number} is missing " + ", ".join(missing)
+            )
+        name = record["name"]
+        if name in (tenant.name for tenant in tenants):
+            raise ValueError(f"{path}: tenant {number} reuses the name {name}")
+        # Secrets can be kept out of the file itself
+        secret = record.get("client_secret")
+        if not secret and record.get("client_secret_env"):
+            secret = os.getenv(record["client_secret_env"])
+        if not secret:
+            raise ValueError(f"{path}: tenant {name} has no client secret")
+        # An empty license_tag falls back to LICENSE_TAG too
+        license_tags = record.get("license_tag") or LICENSE_TAGS
+        if isinstance(license_tags, dict):
+            license_tags = {tag: int(count) for tag, count in license_tags.items()}
+        else:
+            license_tags = parseEntitlements(license_tags)
+        usage_files = record.get("usage_files", [])
+        if isinstance(usage_files, str):
+            usage_files = [usage_files]
+        state_dir = os.path.join(TENANT_DIR, safeName(name))
+        tenants.append(
+            Tenant(
+                name,
+                record["client_id"],
+                secret,
+                record["smart_account"],
+                record["virtual_account"],
+                license_tags,
+                record.get("token_cache")
+                or os.path.join(state_dir, "token_cache.json"),
+                record.get("account_index")
+                or os.path.join(state_dir, "account_index.json"),
+                resolve(record.get("inventory")),
+                [
+                    match
+                    for pattern in usage_files
+                    for match in sorted(glob.glob(resolve(pattern))) or [pattern]
+                ],
+                resolve(record.get("removal_file")),
+            )
+        )
+    return tenants
+
+
+# Token caches & account indexes by file, so every SmartAccount for a tenant
+# shares one copy & writes to each file are serialized
+caches = {}
+caches_lock = threading.Lock()
+
+
+def tenantCaches(tenant):
+    """
+    Returns the (TokenCache, AccountIndex) for a tenant
+    """
+    with caches_lock:
+        key = (tenant.token_cache, tenant.account_index)
+        if key not in caches:
+            caches[key] = (
+                TokenCache(tenant.token_cache),
+                AccountIndex(tenant.account_index, ACCOUNT_INDEX_TTL),
+            )
+        return caches[key]
+
+
+def runTenants(tenants, work, max_workers=None):
+    """
+    Call work(tenant) for every tenant at the same time, each on its own thread
+
+    One tenant failing doesn't stop the others. Returns list of
+    (tenant, result, error) in tenant order, where error is the exception
+    work raised, if any
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def attempt(tenant):
+        try:
+            return tenant, work(tenant), None
+        except Exception as e:
+            console.print(f"[red]{tenant.name}: failed: {e}")
+            return tenant, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tenants) or 1) as executor:
+        return list(executor.map(attempt, tenants))
+
+
+def printSummary(results, columns):
+    """
+    Print a combined table of every tenant's results
+
+    columns are the keys of each result dict to show. Returns the number of
+    tenants that failed
+    """
+    failed = sum(1 for _, _, error in results if error)
+    if console.quiet:
+        return failed
+    from rich.table import Table
+
+    table = Table(title="Tenant Summary")
+    table.add_column("Tenant")
+    for column in columns:
+        table.add_column(column.replace("_", " ").capitalize(), justify="right")
+    table.add_column("Status")
+    for tenant, result, error in results:
+        if error:
+            table.add_row(tenant.name, *["-"] * len(columns), f"[red]Failed: {error}")
+        elif result is None:
+            table.add_row(tenant.name, *["-"] * len(columns), "[yellow]Skipped")
+        else:
+            row = [str(result.get(column, 0)) for column in columns]
+            table.add_row(tenant.name, *row, "[green]OK")
+    totals = [
+        str(sum(result.get(column, 0) for _, result, _ in results if result))
+        for column in columns
+    ]
+    table.add_row("[bold]Total", *totals, f"{len(results) - failed}/{len(results)} OK")
+    console.print()
+    console.print(table)
+    return failed
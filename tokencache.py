@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+import threading
+import time
+
+from storage import readJSON, writeJSONAtomic
+
+DEFAULT_CACHE_FILE = os.path.join("~", ".smartlicensing", "token_cache.json")
+
+# Tokens are refreshed this many seconds before they actually expire
+REFRESH_MARGIN = 300
+
+
+class TokenCache:
+    """
+    OAuth access token cache, keyed by API client ID
+
+    Tokens are held in memory & persisted to a file only readable by the
+    current user, so separate script runs can reuse a still-valid token
+    instead of authenticating to Cisco SSO every time.
+    """
+
+    def __init__(self, path=None, refresh_margin=REFRESH_MARGIN):
+        self.path = os.path.expanduser(path or DEFAULT_CACHE_FILE)
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.tokens = None
+
+    def get(self, client_id):
+        """
+        Returns (access_token, expires_at) for client_id, or None if there is
+        no cached token or it is due for refresh
+        """
+        with self.lock:
+            entry = self.load().get(client_id)
+        if not entry or self.isExpiring(entry["expires_at"]):
+            return None
+        return entry["access_token"], entry["expires_at"]
+
+    def put(self, client_id, access_token, expires_in):
+        """
+        Save a newly issued token. Returns the token's expiry time (epoch seconds)
+        """
+        expires_at = time.time() + int(expires_in)
+        with self.lock:
+            tokens = self.load()
+            tokens[client_id] = {"access_token": access_token, "expires_at": expires_at}
+            self.save(tokens)
+        return expires_at
+
+    def invalidate(self, client_id):
+        """
+        Drop a token that the API has rejected
+        """
+        with self.lock:
+            tokens = self.load()
+            if tokens.pop(client_id, None):
+                self.save(tokens)
+
+    def isExpiring(self, expires_at):
+        """
+        Returns True if a token expiring at expires_at should be refreshed now
+        """
+        return time.time() >= expires_at - self.refresh_margin
+
+    def load(self):
+        # Read from disk on first use, then serve from memory
+        if self.tokens is None:
+            self.tokens = readJSON(self.path, {})
+        return self.tokens
+
+    def save(self, tokens):
+        # Cache file is only readable by the current user
+        writeJSONAtomic(self.path, tokens)
+        self.tokens = tokens
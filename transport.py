@@ -0,0 +1,220 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import zlib
+
+# Defaults for the HTTP connection pool & retry policy
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+RETRIES = 5
+BACKOFF_FACTOR = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Streamed request bodies are sent in chunks of about this many bytes
+BODY_CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+
+
+class SmartLicensingError(Exception):
+    """
+    Base class for errors returned by Cisco SSO or Smart Licensing APIs
+    """
+
+
+class TransportError(SmartLicensingError):
+    """
+    Raised when a request couldn't be completed, such as a timeout or
+    connection failure
+    """
+
+
+class APIError(SmartLicensingError):
+    """
+    Raised when an API responds with an unsuccessful HTTP status
+    """
+
+    def __init__(self, url, status_code, body):
+        self.url = url
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f"Request FAILED. {status_code} from {url}: {body[:500]}")
+
+
+class AuthenticationError(APIError):
+    """
+    Raised for 401/403 responses
+    """
+
+
+class NotFoundError(APIError):
+    """
+    Raised for 404 responses
+    """
+
+
+class RateLimitError(APIError):
+    """
+    Raised for 429 responses that were still throttled after all retries
+    """
+
+
+class ServerError(APIError):
+    """
+    Raised for 5xx responses that still failed after all retries
+    """
+
+
+def raiseForStatus(resp):
+    """
+    Raise the matching APIError for an unsuccessful response
+    """
+    if 200 <= resp.status_code < 300:
+        return
+    if resp.status_code in (401, 403):
+        error = AuthenticationError
+    elif resp.status_code == 404:
+        error = NotFoundError
+    elif resp.status_code == 429:
+        error = RateLimitError
+    elif resp.status_code >= 500:
+        error = ServerError
+    else:
+        error = APIError
+    raise error(resp.url, resp.status_code, resp.text)
+
+
+def createSession(pool_size=POOL_SIZE, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """
+    Create an HTTP session with pooled keep-alive connections & automatic retries
+
+    Connections to Cisco SSO & the Smart Licensing API are kept open & reused,
+    with up to pool_size connections per host. Throttled (429) & 5xx responses
+    are retried with exponential backoff, honouring any Retry-After header.
+
+    The session is only configured here & never modified afterwards, so it can be
+    shared by worker threads.
+    """
+    # requests & urllib3 are slow to import, so wait until a session is needed
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Requests are sent with verify=False, so don't warn about every one
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        # Don't retry reads - a POST may already have been processed
+        read=0,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        backoff_factor=backoff_factor,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def iterJSON(value):
+    """
+    Encode value as JSON a piece at a time
+
+    Objects are encoded key by key & lists item by item, with each list item
+    encoded whole, so a large list of reports is never held as one string.
+    Output matches json.dumps(value)
+    """
+    if isinstance(value, dict):
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            yield f"{', ' if i else ''}{json.dumps(str(key))}: "
+            yield from iterJSON(item)
+        yield "}"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ", "
+            yield json.dumps(item)
+        yield "]"
+    else:
+        yield json.dumps(value)
+
+
+class JSONBody:
+    """
+    Request body that encodes a JSON document while it is being sent
+
+    The body is sent with chunked transfer encoding, optionally gzipped, so
+    the encoded document never has to fit in memory alongside the data it
+    came from. Each iteration encodes the document again from the start, so
+    the body can be resent when a request is retried
+    """
+
+    def __init__(self, value, compress=False, chunk_size=BODY_CHUNK_SIZE):
+        self.value = value
+        self.compress = compress
+        self.chunk_size = chunk_size
+        # Bytes sent by the most recent iteration
+        self.sent = 0
+
+    def __iter__(self):
+        self.sent = 0
+        for chunk in self.chunks():
+            self.sent += len(chunk)
+            yield chunk
+
+    def chunks(self):
+        # wbits=31 writes a gzip header & trailer, as Content-Encoding: gzip expects
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        buffer = []
+        size = 0
+        for piece in iterJSON(self.value):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= self.chunk_size:
+                chunk = "".join(buffer).encode()
+                buffer, size = [], 0
+                chunk = compressor.compress(chunk) if self.compress else chunk
+                # The compressor may buffer a whole chunk without output yet
+                if chunk:
+                    yield chunk
+        chunk = "".join(buffer).encode()
+        if self.compress:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+
+def jsonBody(value, stream=False, compress=False):
+    """
+    Encode value as a JSON request body, optionally streamed & gzipped
+
+    Returns (body, headers), where headers are any extra HTTP headers the
+    body needs
+    """
+    headers = {"Content-Encoding": "gzip"} if compress else {}
+    if stream:
+        return JSONBody(value, compress), headers
+    body = json.dumps(value)
+    if compress:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        body = compressor.compress(body.encode()) + compressor.flush()
+    return body, headers
@@ -0,0 +1,208 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from storage import SQLiteStore
+from usagereport import entitlementTag, reportID
+
+DEFAULT_INDEX_FILE = os.path.join("~", ".smartlicensing", "usage_index.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_items (
+    digest TEXT PRIMARY KEY,
+    pid TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    report_id INTEGER,
+    poll_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_items_poll_id ON usage_items (poll_id);
+CREATE INDEX IF NOT EXISTS usage_items_device
+    ON usage_items (pid, serial, tag, status, report_id);
+CREATE TABLE IF NOT EXISTS watermarks (
+    pid TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    report_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (pid, serial, tag)
+);
+"""
+
+# Usage item statuses
+ACCEPTED = "ACCEPTED"
+ACKNOWLEDGED = "ACKNOWLEDGED"
+FAILED = "FAILED"
+
+# Digests are looked up this many at a time, to stay under SQLite's variable limit
+LOOKUP_BATCH = 500
+
+
+def usageDigest(usage_item):
+    """
+    Returns a SHA-256 hex digest identifying a RUM usage item
+
+    The digest covers the device signature & the exact payload string, so the
+    same report read from two overlapping usage files hashes the same
+    """
+    signature = json.dumps(
+        usage_item["signature"], sort_keys=True, separators=(",", ":")
+    )
+    data = signature + "\n" + usage_item["payload"]
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class UsageIndex(SQLiteStore):
+    """
+    Local record of every RUM usage item uploaded to Smart Licensing
+
+    Items are marked ACCEPTED when an upload containing them is submitted, and
+    ACKNOWLEDGED once its ACK comes back. Usage files overlap a lot between
+    collections, so known items are dropped before building an upload rather
+    than having Smart Licensing reject the whole request as a duplicate.
+
+    Each device & entitlement also has a high-water mark: the highest report ID
+    acknowledged with no earlier report still outstanding. Anything at or below
+    the mark can be skipped while parsing, without hashing it at all.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or DEFAULT_INDEX_FILE)
+
+    def known(self, digests):
+        """
+        Returns the set of digests that have already been uploaded, not
+        counting uploads that failed
+        """
+        digests = list(digests)
+        known = set()
+        with self.lock:
+            for i in range(0, len(digests), LOOKUP_BATCH):
+                batch = digests[i : i + LOOKUP_BATCH]
+                rows = self.db.execute(
+                    "SELECT digest FROM usage_items WHERE status != ? AND digest IN"
+                    f" ({','.join('?' * len(batch))})",
+                    [FAILED, *batch],
+                ).fetchall()
+                known.update(digest for (digest,) in rows)
+        return known
+
+    def filterNew(self, devices):
+        """
+        Drop usage items that have already been uploaded
+
+        devices is a dict of (PID, serial) -> list of usage items, as built by
+        usagereport.groupTaggedUsage. Returns (dict of only new usage items,
+        number of items dropped). Devices left with no new usage are removed
+        """
+        digests = {
+            udi: [usageDigest(usage_item) for usage_item in usage]
+            for udi, usage in devices.items()
+        }
+        seen = self.known(
+            digest for device_digests in digests.values() for digest in device_digests
+        )
+        new = {}
+        dropped = 0
+        for udi, usage in devices.items():
+            items = []
+            for usage_item, digest in zip(usage, digests[udi]):
+                # Also drops repeats of the same item within this upload
+                if digest in seen:
+                    dropped += 1
+                    continue
+                seen.add(digest)
+                items.append(usage_item)
+            if items:
+                new[udi] = items
+        return new, dropped
+
+    def record(self, poll_id, reports):
+        """
+        Mark every usage item in an accepted upload
+        """
+        now = time.time()
+        # Rows are generated as they are inserted, so a large upload isn't
+        # copied in memory
+        rows = (
+            (
+                usageDigest(usage_item),
+                report["sudi"]["udi_pid"],
+                report["sudi"]["udi_serial_number"],
+                entitlementTag(usage_item["payload"]),
+                reportID(usage_item["payload"]),
+                str(poll_id),
+                ACCEPTED,
+                now,
+            )
+            for report in reports
+            for usage_item in report["usage"]
+        )
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO usage_items (digest, pid, serial, tag,"
+                " report_id, poll_id, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def finish(self, poll_id, response):
+        """
+        Save the outcome of an upload & move the high-water marks of the devices
+        it covers. Items in an upload that never completed are sent again next time
+        """
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE usage_items SET status = ?, updated_at = ? WHERE poll_id = ?",
+                (ACKNOWLEDGED if response else FAILED, now, str(poll_id)),
+            )
+            # Recalculated from every item of each device & tag, so it doesn't
+            # matter what order the uploads finish in. A mark never passes an
+            # item that is still outstanding or failed
+            self.db.execute(
+                """
+                INSERT OR REPLACE INTO watermarks (pid, serial, tag, report_id, updated_at)
+                SELECT a.pid, a.serial, a.tag, MAX(a.report_id), ?
+                FROM usage_items a
+                WHERE a.status = ? AND a.report_id IS NOT NULL
+                AND (a.pid, a.serial, a.tag) IN (
+                    SELECT pid, serial, tag FROM usage_items WHERE poll_id = ?
+                )
+                AND a.report_id < COALESCE((
+                    SELECT MIN(b.report_id) FROM usage_items b
+                    WHERE b.pid = a.pid AND b.serial = a.serial AND b.tag = a.tag
+                    AND b.status != ?
+                ), 9223372036854775807)
+                GROUP BY a.pid, a.serial, a.tag
+                """,
+                (now, ACKNOWLEDGED, str(poll_id), ACKNOWLEDGED),
+            )
+
+    def watermarks(self):
+        """
+        Returns dict of (PID, serial, license tag) -> high-water mark report ID
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT pid, serial, tag, report_id FROM watermarks"
+            ).fetchall()
+        return {(pid, serial, tag): report_id for pid, serial, tag, report_id in rows}
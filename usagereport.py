@@ -0,0 +1,291 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import re
+import xml.etree.ElementTree as ET
+
+# Usage files are read in chunks of this many bytes
+CHUNK_SIZE = 64 * 1024
+
+# Several saved usage files may be concatenated together, each with its own
+# XML declaration. These are stripped so all reports parse as one document
+XML_DECLARATION = re.compile(rb"<\?xml[^>]*\?>")
+
+# Compact JSON key that precedes the entitlement tag in a RUM payload
+ENTITLEMENT_TAG_KEY = '"entitlement_tag":"'
+# Compact JSON key that precedes the report ID in a RUM payload
+REPORT_ID_KEY = '"report_id":'
+REPORT_ID = re.compile(r"\d+")
+
+# Default limits for a single usage report upload
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+MAX_REQUEST_ITEMS = 500
+# Approximate JSON overhead of each device report, outside of its usage items
+REPORT_OVERHEAD = 32
+
+
+def readDocumentChunks(usage_file, chunk_size=CHUNK_SIZE):
+    """
+    Read a usage file in chunks, dropping any XML declarations
+
+    Returns a generator of bytes
+    """
+    carry = b""
+    with open(usage_file, "rb") as a:
+        while True:
+            chunk = a.read(chunk_size)
+            if not chunk:
+                break
+            data = XML_DECLARATION.sub(b"", carry + chunk)
+            # Hold back anything that could be the start of a declaration split
+            # across two chunks
+            start = data.rfind(b"<")
+            tail = data[start:] if start >= 0 else b""
+            if start >= 0 and b">" not in tail and b"<?xml".startswith(tail[:5]):
+                carry = tail
+                data = data[:start]
+            else:
+                carry = b""
+            yield data
+    yield carry
+
+
+def iterRUMElements(usage_file, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally read RUMReport elements from a saved device usage file
+
+    Each element is discarded as soon as it has been read, so memory use stays
+    flat no matter how large the file is. Returns a generator of the JSON text
+    of each element
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    # Wrap everything in one root element, so concatenated files are still valid XML
+    parser.feed(b"<usageFiles>")
+    parents = []
+    chunks = readDocumentChunks(usage_file, chunk_size)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            parser.feed(b"</usageFiles>")
+        else:
+            parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag == "RUMReport":
+                text = element.text
+                # Drop the element from the tree before handing back the result
+                parents[-1].remove(element)
+                yield text
+        if chunk is None:
+            parser.close()
+            break
+
+
+def entitlementTag(payload):
+    """
+    Read meta.entitlement_tag from a raw RUM payload string
+
+    Uses a targeted scan of the compact JSON written by devices, and only falls
+    back to parsing the payload if the scan can't find the tag
+    """
+    start = payload.find(ENTITLEMENT_TAG_KEY)
+    if start >= 0:
+        start += len(ENTITLEMENT_TAG_KEY)
+        end = payload.find('"', start)
+        if end >= 0:
+            return payload[start:end]
+    return json.loads(payload)["meta"]["entitlement_tag"]
+
+
+def reportID(payload):
+    """
+    Read meta.report_id from a raw RUM payload string
+
+    Devices number their RUM reports in increasing order. Uses the same targeted
+    scan as entitlementTag. Returns report ID as an int, or None if there isn't one
+    """
+    start = payload.find(REPORT_ID_KEY)
+    if start >= 0:
+        match = REPORT_ID.match(payload, start + len(REPORT_ID_KEY))
+        if match:
+            return int(match.group())
+    report_id = json.loads(payload)["meta"].get("report_id")
+    return None if report_id is None else int(report_id)
+
+
+def isNewUsage(usage_item, tag, watermarks, default_udi=None):
+    """
+    Check a usage item against the high-water marks of earlier uploads
+
+    watermarks is a dict of (PID, serial, license tag) -> last acknowledged
+    report ID. Returns True if the item is newer than its device's mark
+    """
+    if not watermarks:
+        return True
+    udi = deviceUDI(usage_item) or default_udi
+    mark = watermarks.get((*udi, tag)) if udi else None
+    if mark is None:
+        return True
+    report_id = reportID(usage_item["payload"])
+    return report_id is None or report_id > mark
+
+
+def iterTaggedUsageItems(usage_file, license_tags=None, skip=()):
+    """
+    Read usage reports for any of license_tags from a saved device usage file
+
+    license_tags may be a single tag or a collection of tags. All tags are
+    kept if it is None. skip holds the numbers of items to leave out, counting
+    from 1, such as items that failed pre-flight checks. Returns a generator
+    of (license tag, usage item)
+    """
+    if isinstance(license_tags, str):
+        license_tags = {license_tags}
+    # Each XML item is an individual license usage report. We only need the
+    # entitlement tag from the report payload to decide whether to keep it
+    for number, text in enumerate(iterRUMElements(usage_file), start=1):
+        if number in skip:
+            continue
+        usage_item = json.loads(text)
+        payload = usage_item["payload"]
+        tag = entitlementTag(payload)
+        if license_tags is None or tag in license_tags:
+            # Payload must match EXACTLY what we receive from the device usage report,
+            # or the signature will be invalid & the report rejected. So the original
+            # payload string is passed through untouched
+            yield tag, {"payload": payload, "signature": usage_item["signature"]}
+
+
+def indexTaggedUsage(tagged_items, watermarks=None, default_udi=None, index=None):
+    """
+    Index (license tag, usage item) pairs by entitlement tag
+
+    Items at or below their device's high-water mark in watermarks are skipped,
+    see isNewUsage. Items are added to index if given. Returns dict of license
+    tag -> list of usage items
+    """
+    index = {} if index is None else index
+    for tag, usage_item in tagged_items:
+        if isNewUsage(usage_item, tag, watermarks, default_udi):
+            index.setdefault(tag, []).append(usage_item)
+    return index
+
+
+def deviceUDI(usage_item):
+    """
+    Returns (PID, serial) of the device that signed a usage item, or None
+    """
+    sudi = usage_item["signature"].get("sudi")
+    if not sudi:
+        return None
+    return (sudi["udi_pid"], sudi["udi_serial_number"])
+
+
+def groupTaggedUsage(
+    tagged_items, default_udi=None, watermarks=None, devices=None, source="usage"
+):
+    """
+    Group (license tag, usage item) pairs by device
+
+    Items without a signing device are assigned to default_udi. Items at or
+    below their device's high-water mark in watermarks are skipped. Items are
+    added to devices if given. source names where the items came from in
+    errors. Returns dict of (PID, serial) -> list of usage items
+    """
+    devices = {} if devices is None else devices
+    for tag, usage_item in tagged_items:
+        if not isNewUsage(usage_item, tag, watermarks, default_udi):
+            continue
+        udi = deviceUDI(usage_item) or default_udi
+        if udi is None:
+            raise ValueError(f"{source}: usage item has no device UDI")
+        devices.setdefault(udi, []).append(usage_item)
+    return devices
+
+
+def buildReports(devices):
+    """
+    Build the "reports" list for a v2/devices/reportusage request, with one
+    report per device
+    """
+    return [
+        {"sudi": {"udi_pid": pid, "udi_serial_number": serial}, "usage": usage}
+        for (pid, serial), usage in devices.items()
+    ]
+
+
+def reportTags(reports):
+    """
+    Returns dict of (PID, serial) -> set of entitlement tags in a list of
+    device reports
+    """
+    tags = {}
+    for report in reports:
+        udi = (report["sudi"]["udi_pid"], report["sudi"]["udi_serial_number"])
+        tags.setdefault(udi, set()).update(
+            entitlementTag(usage_item["payload"]) for usage_item in report["usage"]
+        )
+    return tags
+
+
+def chunkReports(reports, max_bytes=MAX_REQUEST_BYTES, max_items=MAX_REQUEST_ITEMS):
+    """
+    Split device reports into upload chunks
+
+    Each chunk stays under max_bytes of serialized usage data & max_items usage
+    items. A device with more usage than fits in one chunk is split across
+    several, each carrying the same SUDI. Returns a generator of report lists
+    """
+    chunk = []
+    chunk_bytes = 0
+    chunk_items = 0
+    for report in reports:
+        current = None
+        sudi_bytes = len(json.dumps(report["sudi"])) + REPORT_OVERHEAD
+        item_sizes = [len(json.dumps(usage_item)) + 2 for usage_item in report["usage"]]
+        report_bytes = sudi_bytes + sum(item_sizes)
+        report_items = len(item_sizes)
+        # Keep a device's report whole by starting a new chunk, unless it
+        # wouldn't fit in an empty chunk either
+        if (
+            chunk
+            and report_bytes <= max_bytes
+            and report_items <= max_items
+            and (
+                chunk_bytes + report_bytes > max_bytes
+                or chunk_items + report_items > max_items
+            )
+        ):
+            yield chunk
+            chunk, chunk_bytes, chunk_items = [], 0, 0
+        for usage_item, item_bytes in zip(report["usage"], item_sizes):
+            extra = item_bytes + (0 if current else sudi_bytes)
+            if chunk and (
+                chunk_bytes + extra > max_bytes or chunk_items + 1 > max_items
+            ):
+                yield chunk
+                chunk, chunk_bytes, chunk_items, current = [], 0, 0, None
+                extra = item_bytes + sudi_bytes
+            if current is None:
+                current = {"sudi": report["sudi"], "usage": []}
+                chunk.append(current)
+            current["usage"].append(usage_item)
+            chunk_bytes += extra
+            chunk_items += 1
+    if chunk:
+        yield chunk
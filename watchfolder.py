@@ -0,0 +1,239 @@
+"""
+Copyright (c) 2022 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+import select
+import socket
+import time
+
+# inotify events for a file that has finished being written or was moved in
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+# Files are left alone until they haven't changed for this many seconds, in
+# case they are still being copied in
+SETTLE_TIME = 2.0
+POLL_INTERVAL = 5.0
+
+# Sub-directories of the inbox for files being worked on & files that failed
+PROCESSING_DIR = ".processing"
+FAILED_DIR = ".failed"
+
+# Partially copied files are often given one of these suffixes until complete
+TEMP_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload")
+
+
+class DirectoryWatcher:
+    """
+    Waits for files to be written to or moved into a directory
+
+    Uses inotify on Linux, and falls back to polling the directory every
+    poll_interval seconds elsewhere. Either way, wait() just signals that
+    something may have changed, so callers should list the directory after
+    """
+
+    def __init__(self, path, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.fd = None
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if (
+                libc.inotify_add_watch(
+                    fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO
+                )
+                < 0
+            ):
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            self.fd = fd
+        except (AttributeError, OSError):
+            # No inotify on this platform or filesystem
+            self.fd = None
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def wait(self, timeout):
+        """
+        Block until the directory changes or timeout seconds pass
+        """
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            # Drain all queued events, we only care that something happened
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def pidRunning(pid):
+    """
+    Returns whether a process with this ID is running on this host
+    """
+    if os.name == "nt":
+        # os.kill() would terminate the process on Windows, so ask the kernel
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return code.value == 259
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by someone else
+        pass
+    return True
+
+
+class Inbox:
+    """
+    A directory that files are dropped into for processing
+
+    Files are claimed by renaming them into a processing sub-directory, which
+    is atomic, so several workers (or daemons) never pick up the same file.
+    Each daemon claims into its own <host>-<pid> sub-directory, so one can tell
+    its claims apart from those of other daemons sharing the inbox.
+    """
+
+    def __init__(self, path, settle_time=SETTLE_TIME):
+        self.path = path
+        self.settle_time = settle_time
+        self.host = socket.gethostname()
+        self.processing_root = os.path.join(path, PROCESSING_DIR)
+        self.processing = os.path.join(
+            self.processing_root, f"{self.host}-{os.getpid()}"
+        )
+        self.failed = os.path.join(path, FAILED_DIR)
+        os.makedirs(self.processing, exist_ok=True)
+        os.makedirs(self.failed, exist_ok=True)
+
+    def pending(self):
+        """
+        Returns (list of file names ready to claim, seconds until the next
+        unsettled file is ready or None)
+        """
+        ready = []
+        next_ready = None
+        now = time.time()
+        for entry in os.scandir(self.path):
+            if (
+                not entry.is_file()
+                or entry.name.startswith(".")
+                or entry.name.lower().endswith(TEMP_SUFFIXES)
+            ):
+                continue
+            age = now - entry.stat().st_mtime
+            if age >= self.settle_time:
+                ready.append((entry.stat().st_mtime, entry.name))
+            else:
+                wait = self.settle_time - age
+                next_ready = wait if next_ready is None else min(next_ready, wait)
+        # Oldest files first
+        return [name for mtime, name in sorted(ready)], next_ready
+
+    def claim(self, name):
+        """
+        Move a file into the processing directory
+
+        Returns the claimed file's path, or None if someone else claimed it first
+        """
+        path = os.path.join(self.processing, name)
+        try:
+            os.rename(os.path.join(self.path, name), path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def release(self, path):
+        """
+        Put a claimed file back in the inbox, so it is picked up again later
+        """
+        os.replace(path, os.path.join(self.path, os.path.basename(path)))
+
+    def fail(self, path, error):
+        """
+        Move a claimed file to the failed directory, with the error next to it
+        """
+        name = os.path.basename(path)
+        os.replace(path, os.path.join(self.failed, name))
+        with open(os.path.join(self.failed, name + ".error.txt"), "w") as a:
+            a.write(f"{error}\n")
+
+    def recover(self):
+        """
+        Put back any files left claimed by daemons on this host that are no
+        longer running. Returns their names
+
+        Claims by daemons on other hosts are left alone, as there's no telling
+        from here whether they are still running
+        """
+        names = []
+        for entry in sorted(os.scandir(self.processing_root), key=lambda e: e.name):
+            if entry.is_file():
+                # Claimed before claims were kept per daemon
+                names.append(entry.name)
+                self.release(entry.path)
+                continue
+            host, _, pid = entry.name.rpartition("-")
+            if (
+                entry.path == self.processing
+                or host != self.host
+                or not pid.isdigit()
+                or pidRunning(int(pid))
+            ):
+                continue
+            for name in sorted(os.listdir(entry.path)):
+                names.append(name)
+                self.release(os.path.join(entry.path, name))
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                # A file was dropped in since, leave it for next time
+                pass
+        return names
+
+    def close(self):
+        """
+        Remove this daemon's processing directory if nothing is left in it
+        """
+        try:
+            os.rmdir(self.processing)
+        except OSError:
+            pass